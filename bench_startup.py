@@ -0,0 +1,76 @@
+"""Startup benchmark: import time of server.py, warmup cost and first-request latency.
+
+Each measurement runs in a fresh interpreter so nothing is cached between runs.
+Results are appended as one JSON line per run, keyed by git commit, so cold-start
+regressions show up when comparing commits:
+
+    python bench_startup.py --runs 5 --out startup_bench.jsonl
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime
+
+PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+import server
+t1 = time.perf_counter()
+client = server.app.test_client()
+client.get("/", headers={"Accept-Encoding": "gzip"})
+t2 = time.perf_counter()
+server.warmup()
+t3 = time.perf_counter()
+client.get("/api/ready")
+t4 = time.perf_counter()
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "first_request_ms": (t2 - t1) * 1000,
+    "warmup_ms": (t3 - t2) * 1000,
+    "ready_request_ms": (t4 - t3) * 1000,
+}))
+"""
+
+
+def git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return ""
+
+
+def run_once():
+    env = dict(os.environ)
+    env.setdefault("XAI_API_KEY", "bench")
+    env.pop("DATABASE_URL", None)
+    out = subprocess.check_output([sys.executable, "-c", PROBE], env=env, text=True, stderr=subprocess.DEVNULL)
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--out", default="", help="append the summary as a JSON line to this file")
+    args = parser.parse_args()
+
+    samples = [run_once() for _ in range(args.runs)]
+    summary = {
+        "commit": git_rev(),
+        "at": datetime.now().isoformat(timespec="seconds"),
+        "runs": args.runs,
+    }
+    for key in ("import_ms", "first_request_ms", "warmup_ms", "ready_request_ms"):
+        values = [s[key] for s in samples]
+        summary[key] = round(statistics.median(values), 1)
+        summary[key.replace("_ms", "_max_ms")] = round(max(values), 1)
+    print(json.dumps(summary, indent=2))
+    if args.out:
+        with open(args.out, "a", encoding="utf-8") as f:
+            f.write(json.dumps(summary) + "\n")
+
+
+if __name__ == "__main__":
+    main()
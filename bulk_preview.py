@@ -0,0 +1,197 @@
+"""Bulk offline preview generation for prospect lists.
+
+Reads a CSV or JSONL file whose columns/keys match the leads schema (business,
+type, vibe, email, name, phone, tagline, colors, services, audience, features,
+optionally job_id), builds a preview page for every row with the same model,
+image and post-processing path as the chat build, and saves each result through
+save_lead_to_db.
+
+Finished rows are appended to a checkpoint file, so a crashed or interrupted run
+picks up where it stopped:
+
+    python bulk_preview.py prospects.csv --concurrency 4 --rate 20
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import server
+
+LEAD_FIELDS = ["business", "type", "vibe", "email", "name", "phone", "tagline", "colors", "services", "audience", "features"]
+
+
+class RateLimiter:
+    """Spaces out build starts to at most `per_minute` per minute."""
+
+    def __init__(self, per_minute):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self.next_at = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start_at = max(now, self.next_at)
+            self.next_at = start_at + self.interval
+        if start_at > now:
+            time.sleep(start_at - now)
+
+
+def read_rows(path):
+    # utf-8-sig: CSVs exported from Excel/Sheets start with a BOM that would end up in the first column name
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if path.endswith(".jsonl"):
+            for n, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                row = json.loads(line)
+                if not isinstance(row, dict):
+                    print(f"[bulk] Skipping line {n}: expected a JSON object, got {type(row).__name__}")
+                    continue
+                yield row
+        else:
+            yield from csv.DictReader(f)
+
+
+def row_to_lead(row):
+    return {k: str(row.get(k) or "").strip() for k in LEAD_FIELDS}
+
+
+def row_job_id(row, lead):
+    """Stable job id per prospect, so re-runs upsert the same leads row."""
+    if row.get("job_id"):
+        return str(row["job_id"]).strip()
+    key = "|".join(lead[k].lower() for k in ("business", "type", "email"))
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"bulk:{key}"))
+
+
+def load_checkpoint(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from a crash
+            if entry.get("status") == "done":
+                done.add(entry["job_id"])
+    return done
+
+
+def build_row(job_id, lead, with_images):
+    """Runs in a pool worker. Returns (job_id, page_html or None, report, error)."""
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            page_future = executor.submit(server._generate_page_html, lead, job_id)
+            image_future = executor.submit(server.generate_images_for_page, lead, job_id) if with_images else None
+            raw_html = page_future.result(timeout=120)
+            images = {}
+            if image_future is not None:
+                try:
+                    images = image_future.result(timeout=120)
+                except Exception as img_err:
+                    print(f"[bulk] Image generation failed for {job_id}, continuing without: {img_err}")
+        page_html, report = server.finalize_page_html(raw_html, images, job_id)
+        return job_id, page_html, report, None if page_html else "invalid HTML"
+    except Exception as e:
+        return job_id, None, {}, str(e)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate preview pages for a list of prospects.")
+    parser.add_argument("input", help="CSV or JSONL file with lead fields")
+    parser.add_argument("--concurrency", type=int, default=4, help="builds in flight at once (default 4)")
+    parser.add_argument("--rate", type=float, default=30, help="max builds started per minute, 0 = unlimited (default 30)")
+    parser.add_argument("--processes", action="store_true", help="use a process pool instead of threads")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <input>.checkpoint.jsonl)")
+    parser.add_argument("--no-images", action="store_true", help="skip custom image generation")
+    parser.add_argument("--sheets", action="store_true", help="also sync each lead to Google Sheets")
+    args = parser.parse_args(argv)
+
+    checkpoint_path = args.checkpoint or args.input + ".checkpoint.jsonl"
+    done_ids = load_checkpoint(checkpoint_path)
+    entry_context = json.dumps({"entryPoint": "bulk", "source": os.path.basename(args.input)})
+
+    pending = []
+    skipped = 0
+    for row in read_rows(args.input):
+        lead = row_to_lead(row)
+        if not lead["business"]:
+            print(f"[bulk] Skipping row without business: {row}")
+            continue
+        job_id = row_job_id(row, lead)
+        if job_id in done_ids:
+            skipped += 1
+            continue
+        pending.append((job_id, lead))
+
+    total = len(pending)
+    print(f"[bulk] {total} rows to build, {skipped} already done per {checkpoint_path}")
+    if not total:
+        return 0
+
+    limiter = RateLimiter(args.rate)
+    pool_cls = ProcessPoolExecutor if args.processes else ThreadPoolExecutor
+    leads_by_id = dict(pending)
+    completed = failed = page_bytes = 0
+    started = time.monotonic()
+
+    with pool_cls(max_workers=args.concurrency) as pool, open(checkpoint_path, "a", encoding="utf-8") as checkpoint:
+        queue = iter(pending)
+        in_flight = set()
+        while True:
+            while len(in_flight) < args.concurrency:
+                item = next(queue, None)
+                if item is None:
+                    break
+                limiter.wait()
+                in_flight.add(pool.submit(build_row, item[0], item[1], not args.no_images))
+            if not in_flight:
+                break
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job_id, page_html, report, error = future.result()
+                lead = leads_by_id[job_id]
+                status = "done" if page_html else "error"
+                saved = server.save_lead_to_db(job_id, lead, status=status, page_html=page_html,
+                                               entry_context=entry_context, sync_sheet=False)
+                if args.sheets:
+                    server.sync_lead_to_sheet(job_id, lead, status, entry_context)
+                if page_html and saved:
+                    completed += 1
+                    page_bytes += report.get("bytes_out", 0)
+                else:
+                    failed += 1
+                    print(f"[bulk] {lead['business']} ({job_id}) failed: {error or 'could not save lead'}")
+                checkpoint.write(json.dumps({"job_id": job_id, "business": lead["business"],
+                                             "status": "done" if page_html and saved else "error",
+                                             "error": error}) + "\n")
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+
+                processed = completed + failed
+                elapsed = time.monotonic() - started
+                per_min = processed / elapsed * 60 if elapsed else 0.0
+                eta = (total - processed) / per_min if per_min else 0.0
+                print(f"[bulk] {processed}/{total} ({completed} done, {failed} failed) "
+                      f"{per_min:.1f} rows/min, eta {eta:.1f} min")
+
+    elapsed = time.monotonic() - started
+    avg_kb = page_bytes / completed / 1024 if completed else 0.0
+    print(f"[bulk] Finished {completed}/{total} in {elapsed:.0f}s, {failed} failed, avg page {avg_kb:.1f} KB")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,15 @@
+# Picked up automatically by gunicorn from the working directory.
+# preload_app imports server.py once in the master so heavy modules and static
+# assets are shared copy-on-write by every worker; sockets are opened post-fork.
+
+preload_app = True
+
+
+def on_starting(server):
+    import server as app_module
+    app_module.warmup()
+
+
+def post_fork(server, worker):
+    import server as app_module
+    app_module.warm_worker()
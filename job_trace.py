@@ -0,0 +1,146 @@
+"""Per-job span tracing: chat turn -> build -> delivered preview.
+
+Spans and point events are keyed by job_id and appended to a local JSONL sink
+by a background writer thread, so recording one costs a dict and a queue put
+on the request/build path. Every gunicorn worker appends to the same file in
+whole-line writes; timeline() reads it back for one job.
+"""
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Outside the app root on purpose: server.py serves that whole directory as static files
+TRACE_PATH = os.environ.get("JOB_TRACE_PATH", os.path.join(tempfile.gettempdir(), "bouw_job_traces.jsonl"))
+TRACE_MAX_BYTES = int(os.environ.get("JOB_TRACE_MAX_BYTES", str(50 * 1024 * 1024)))
+TRACE_FLUSH_SECONDS = 0.5
+
+_queue = queue.SimpleQueue()
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _ensure_writer():
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        return
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_write_forever, daemon=True)
+            _writer.start()
+
+
+def _write_forever():
+    while True:
+        batch = [_queue.get()]
+        deadline = time.monotonic() + TRACE_FLUSH_SECONDS
+        while time.monotonic() < deadline:
+            try:
+                batch.append(_queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        try:
+            _rotate_if_needed()
+            data = "".join(json.dumps(rec, default=str) + "\n" for rec in batch)
+            with open(TRACE_PATH, "a", encoding="utf-8") as f:
+                f.write(data)
+        except Exception as e:
+            print(f"[trace] Failed to write {len(batch)} spans: {e}")
+
+
+def _rotate_if_needed():
+    try:
+        if os.path.getsize(TRACE_PATH) > TRACE_MAX_BYTES:
+            os.replace(TRACE_PATH, TRACE_PATH + ".1")
+    except FileNotFoundError:
+        pass
+
+
+def _record(rec):
+    _queue.put(rec)
+    _ensure_writer()
+
+
+def event(job_id, name, **attrs):
+    """A point-in-time event (zero duration)."""
+    if not job_id:
+        return
+    _record({"job_id": job_id, "name": name, "start": time.time(), "duration_ms": 0.0,
+             "status": "ok", "pid": os.getpid(), "attrs": attrs})
+
+
+@contextmanager
+def span(job_id, name, **attrs):
+    """Time a block. The yielded dict can be filled with attributes known only at the end."""
+    if not job_id:
+        yield attrs
+        return
+    start_wall = time.time()
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield attrs
+    except Exception as e:
+        # Cooperative cancellation (e.g. a superseded build) is not a failure
+        status = "cancelled" if getattr(e, "cancelled", False) else "error"
+        attrs["error"] = str(e)[:300]
+        raise
+    finally:
+        _record({"job_id": job_id, "name": name, "start": start_wall,
+                 "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+                 "status": status, "pid": os.getpid(), "attrs": attrs})
+
+
+def _read_spans(job_id):
+    spans = []
+    needle = f'"job_id": "{job_id}"'
+    for path in (TRACE_PATH + ".1", TRACE_PATH):
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if needle in line:
+                        try:
+                            spans.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            continue
+        except FileNotFoundError:
+            continue
+    return spans
+
+
+def timeline(job_id):
+    """All spans for a job ordered by start, with offsets from the trigger and a per-stage breakdown."""
+    spans = sorted(_read_spans(job_id), key=lambda s: s["start"])
+    if not spans:
+        return None
+    t0 = spans[0]["start"]
+    breakdown = {}
+    for s in spans:
+        s["offset_ms"] = round((s["start"] - t0) * 1000, 1)
+        s["end_offset_ms"] = round(s["offset_ms"] + s["duration_ms"], 1)
+        breakdown[s["name"]] = round(breakdown.get(s["name"], 0.0) + s["duration_ms"], 1)
+
+    def first(name):
+        return next((s for s in spans if s["name"] == name), None)
+
+    summary = {"total_ms": round(max(s["end_offset_ms"] for s in spans), 1)}
+    build = first("build")
+    if build:
+        summary["build_ms"] = build["duration_ms"]
+        summary["build_status"] = build["attrs"].get("result", build["status"])
+    model = first("model.page")
+    if model:
+        summary["model_ms"] = model["duration_ms"]
+    # Single-call builds report tokens on model.page; sectioned builds on model.plan / model.section.*
+    tokens = [s["attrs"].get("completion_tokens") for s in spans if s["name"].startswith("model.")]
+    if any(t is not None for t in tokens):
+        summary["completion_tokens"] = sum(t or 0 for t in tokens)
+    done_poll = first("poll.first_done")
+    if done_poll:
+        summary["first_done_poll_ms"] = done_poll["offset_ms"]
+    slowest = max(spans, key=lambda s: s["duration_ms"])
+    summary["slowest_span"] = {"name": slowest["name"], "duration_ms": slowest["duration_ms"]}
+    return {"job_id": job_id, "summary": summary, "breakdown_ms": breakdown, "spans": spans}
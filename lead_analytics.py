@@ -0,0 +1,289 @@
+"""Incrementally maintained lead funnel rollups.
+
+Every lead write goes through save_lead_to_db, which calls record_transition().
+A small per-lead state row pins the lead's cohort (day, entry point, type,
+vibe) and detects each transition exactly once — new lead, email collected,
+build finished — bumping counters in lead_funnel_daily and a build-latency
+histogram. /api/analytics then reads a handful of rollup rows instead of
+scanning leads and its page_html column.
+"""
+import json
+import threading
+
+# Upper bounds (ms) of the build latency histogram buckets; the last is open-ended
+LATENCY_BUCKETS_MS = [1000, 2000, 5000, 10000, 15000, 20000, 30000, 45000, 60000, 90000, 120000, 180000]
+GROUP_FIELDS = ("day", "entry_point", "type", "vibe")
+TERMINAL_STATUSES = ("done", "error")
+
+# Columns lead writes need (entry_point for the rollups, generation for superseded builds);
+# the rollup tables below are only touched by the (failure-tolerant) analytics path, so
+# their DDL never blocks saving a lead
+LEADS_SCHEMA = [
+    "ALTER TABLE leads ADD COLUMN IF NOT EXISTS entry_point VARCHAR(64) DEFAULT ''",
+    "ALTER TABLE leads ADD COLUMN IF NOT EXISTS generation INTEGER DEFAULT 1",
+]
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS lead_funnel_state (
+        job_id VARCHAR(64) PRIMARY KEY,
+        day DATE NOT NULL DEFAULT CURRENT_DATE,
+        entry_point VARCHAR(64) NOT NULL DEFAULT '',
+        type VARCHAR(64) NOT NULL DEFAULT '',
+        vibe VARCHAR(32) NOT NULL DEFAULT '',
+        status VARCHAR(32) NOT NULL DEFAULT 'building',
+        has_email BOOLEAN NOT NULL DEFAULT FALSE,
+        started_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )""",
+    """CREATE TABLE IF NOT EXISTS lead_funnel_daily (
+        day DATE NOT NULL,
+        entry_point VARCHAR(64) NOT NULL,
+        type VARCHAR(64) NOT NULL,
+        vibe VARCHAR(32) NOT NULL,
+        leads INTEGER NOT NULL DEFAULT 0,
+        with_email INTEGER NOT NULL DEFAULT 0,
+        builds_done INTEGER NOT NULL DEFAULT 0,
+        builds_error INTEGER NOT NULL DEFAULT 0,
+        build_ms_sum BIGINT NOT NULL DEFAULT 0,
+        build_ms_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, entry_point, type, vibe)
+    )""",
+    """CREATE TABLE IF NOT EXISTS lead_build_latency (
+        day DATE NOT NULL,
+        entry_point VARCHAR(64) NOT NULL,
+        type VARCHAR(64) NOT NULL,
+        vibe VARCHAR(32) NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, entry_point, type, vibe, bucket)
+    )""",
+]
+
+# One-time, idempotent backfill for leads written before the rollups existed: fill
+# entry_point from entry_context, then seed the per-lead state and daily counters
+# for every lead without a state row (build latency is unknown for those, so no histogram)
+BACKFILL = [
+    """UPDATE leads SET entry_point = filled.entry_point
+       FROM (SELECT id, LEFT(CASE WHEN LEFT(entry_context, 1) = '{'
+                                  THEN CAST(entry_context AS json)->>'entryPoint' END, 64) AS entry_point
+             FROM leads WHERE COALESCE(entry_point, '') = '') AS filled
+       WHERE leads.id = filled.id AND COALESCE(filled.entry_point, '') <> ''""",
+    """WITH seeded AS (
+        INSERT INTO lead_funnel_state (job_id, day, entry_point, type, vibe, status, has_email, started_at)
+        SELECT job_id, CAST(COALESCE(created_at, CURRENT_TIMESTAMP) AS DATE), COALESCE(entry_point, ''),
+               LEFT(LOWER(TRIM(COALESCE(type, ''))), 64), LEFT(COALESCE(vibe, ''), 32),
+               COALESCE(status, 'building'), COALESCE(email, '') <> '', COALESCE(created_at, CURRENT_TIMESTAMP)
+        FROM leads
+        WHERE job_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM lead_funnel_state s WHERE s.job_id = leads.job_id)
+        ON CONFLICT (job_id) DO NOTHING
+        RETURNING day, entry_point, type, vibe, status, has_email
+    )
+    INSERT INTO lead_funnel_daily (day, entry_point, type, vibe, leads, with_email, builds_done, builds_error)
+    SELECT day, entry_point, type, vibe, COUNT(*),
+           SUM(CASE WHEN has_email THEN 1 ELSE 0 END),
+           SUM(CASE WHEN status = 'done' THEN 1 ELSE 0 END),
+           SUM(CASE WHEN status = 'error' THEN 1 ELSE 0 END)
+    FROM seeded GROUP BY day, entry_point, type, vibe
+    ON CONFLICT (day, entry_point, type, vibe) DO UPDATE SET
+        leads = lead_funnel_daily.leads + EXCLUDED.leads,
+        with_email = lead_funnel_daily.with_email + EXCLUDED.with_email,
+        builds_done = lead_funnel_daily.builds_done + EXCLUDED.builds_done,
+        builds_error = lead_funnel_daily.builds_error + EXCLUDED.builds_error""",
+]
+
+_schema_ready = False
+_leads_schema_ready = False
+_schema_lock = threading.Lock()
+
+
+def ensure_leads_schema(conn):
+    global _leads_schema_ready
+    if _leads_schema_ready:
+        return
+    with _schema_lock:
+        if _leads_schema_ready:
+            return
+        cur = conn.cursor()
+        for stmt in LEADS_SCHEMA:
+            cur.execute(stmt)
+        cur.close()
+        _leads_schema_ready = True
+
+
+def ensure_schema(conn):
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        cur = conn.cursor()
+        for stmt in SCHEMA:
+            cur.execute(stmt)
+        _backfill(cur)
+        cur.close()
+        _schema_ready = True
+
+
+def _backfill(cur):
+    for stmt in BACKFILL:
+        try:
+            cur.execute(stmt)
+        except Exception as e:
+            # e.g. malformed legacy entry_context JSON: the rollups still work for new writes
+            print(f"[analytics] Backfill of existing leads failed: {e}")
+
+
+def parse_entry_point(entry_context):
+    """entryPoint out of the entry_context JSON string, parsed once at write time."""
+    if not entry_context:
+        return ""
+    try:
+        ctx = json.loads(entry_context)
+    except (TypeError, ValueError):
+        return ""
+    return str(ctx.get("entryPoint", "") if isinstance(ctx, dict) else "")[:64]
+
+
+def _bucket_for(ms):
+    for i, bound in enumerate(LATENCY_BUCKETS_MS):
+        if ms <= bound:
+            return i
+    return len(LATENCY_BUCKETS_MS)
+
+
+def _bump(cur, cohort, **counters):
+    cols = ", ".join(counters)
+    sets = ", ".join(f"{c} = lead_funnel_daily.{c} + EXCLUDED.{c}" for c in counters)
+    cur.execute(
+        f"INSERT INTO lead_funnel_daily (day, entry_point, type, vibe, {cols}) "
+        f"VALUES (%s, %s, %s, %s{', %s' * len(counters)}) "
+        f"ON CONFLICT (day, entry_point, type, vibe) DO UPDATE SET {sets}",
+        (*cohort, *counters.values()),
+    )
+
+
+def record_transition(conn, job_id, lead, status, entry_point):
+    """Apply this write's funnel transitions to the rollups in one transaction."""
+    ensure_schema(conn)
+    cur = conn.cursor()
+    try:
+        cur.execute("BEGIN")
+        cur.execute(
+            "INSERT INTO lead_funnel_state (job_id, entry_point, type, vibe, status) VALUES (%s, %s, %s, %s, %s) "
+            "ON CONFLICT (job_id) DO NOTHING RETURNING day, entry_point, type, vibe",
+            (job_id, entry_point, (lead.get("type") or "").strip().lower()[:64], (lead.get("vibe") or "")[:32], status),
+        )
+        row = cur.fetchone()
+        if row:
+            _bump(cur, tuple(row), leads=1)
+            if status in TERMINAL_STATUSES:
+                # Written finished in one go (bulk runs): count the outcome, no latency to measure
+                _bump(cur, tuple(row), **{"builds_done" if status == "done" else "builds_error": 1})
+
+        if lead.get("email"):
+            cur.execute(
+                "UPDATE lead_funnel_state SET has_email = TRUE WHERE job_id = %s AND NOT has_email "
+                "RETURNING day, entry_point, type, vibe",
+                (job_id,),
+            )
+            row = cur.fetchone()
+            if row:
+                _bump(cur, tuple(row), with_email=1)
+
+        if status in TERMINAL_STATUSES:
+            # building -> done/error, or error -> done when a failed build is retried (bulk re-runs)
+            from_statuses = ("building", "error") if status == "done" else ("building",)
+            cur.execute(
+                "UPDATE lead_funnel_state SET status = %s WHERE job_id = %s "
+                f"AND status IN ({', '.join(['%s'] * len(from_statuses))}) "
+                "RETURNING day, entry_point, type, vibe, EXTRACT(EPOCH FROM (CURRENT_TIMESTAMP - started_at)) * 1000, "
+                "(SELECT status FROM lead_funnel_state WHERE job_id = %s)",
+                (status, job_id, *from_statuses, job_id),
+            )
+            row = cur.fetchone()  # the RETURNING sub-select sees the status from before this UPDATE
+            if row:
+                cohort, ms = tuple(row[:4]), int(row[4] or 0)
+                if row[5] == "error":
+                    # The earlier failure no longer stands; started_at is from the first attempt, so no latency
+                    _bump(cur, cohort, builds_error=-1, builds_done=1)
+                elif status == "done":
+                    _bump(cur, cohort, builds_done=1, build_ms_sum=ms, build_ms_count=1)
+                    cur.execute(
+                        "INSERT INTO lead_build_latency (day, entry_point, type, vibe, bucket, count) "
+                        "VALUES (%s, %s, %s, %s, %s, 1) ON CONFLICT (day, entry_point, type, vibe, bucket) "
+                        "DO UPDATE SET count = lead_build_latency.count + 1",
+                        (*cohort, _bucket_for(ms)),
+                    )
+                else:
+                    _bump(cur, cohort, builds_error=1)
+        cur.execute("COMMIT")
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+    finally:
+        cur.close()
+
+
+def _percentile(hist, p):
+    total = sum(hist.values())
+    if not total:
+        return None
+    need, seen = total * p, 0
+    for bucket in sorted(hist):
+        seen += hist[bucket]
+        if seen >= need:
+            # The last bucket is open-ended: say so rather than look like "no data"
+            return LATENCY_BUCKETS_MS[bucket] if bucket < len(LATENCY_BUCKETS_MS) else f">{LATENCY_BUCKETS_MS[-1]}"
+    return None
+
+
+def funnel_report(conn, days=30, group_by=("entry_point",)):
+    """Aggregate the last `days` of rollup rows by any of day/entry_point/type/vibe."""
+    ensure_schema(conn)
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT day, entry_point, type, vibe, leads, with_email, builds_done, builds_error, build_ms_sum, build_ms_count "
+        "FROM lead_funnel_daily WHERE day >= CURRENT_DATE - CAST(%s AS INTEGER)",
+        (days,),
+    )
+    rows = cur.fetchall()
+    cur.execute(
+        "SELECT day, entry_point, type, vibe, bucket, count FROM lead_build_latency WHERE day >= CURRENT_DATE - CAST(%s AS INTEGER)",
+        (days,),
+    )
+    hist_rows = cur.fetchall()
+    cur.close()
+
+    idx = [GROUP_FIELDS.index(g) for g in group_by]
+
+    def key_of(row):
+        return tuple(row[i].isoformat() if hasattr(row[i], "isoformat") else row[i] for i in idx)
+
+    groups = {}
+    for row in rows:
+        g = groups.setdefault(key_of(row), {"leads": 0, "with_email": 0, "builds_done": 0, "builds_error": 0,
+                                            "build_ms_sum": 0, "build_ms_count": 0, "hist": {}})
+        for name, value in zip(("leads", "with_email", "builds_done", "builds_error", "build_ms_sum", "build_ms_count"), row[4:]):
+            g[name] += int(value or 0)
+    for row in hist_rows:
+        g = groups.get(key_of(row))
+        if g is not None:
+            g["hist"][row[4]] = g["hist"].get(row[4], 0) + int(row[5])
+
+    result = []
+    for key, g in sorted(groups.items(), key=lambda kv: -kv[1]["leads"]):
+        finished = g["builds_done"] + g["builds_error"]
+        result.append({
+            **dict(zip(group_by, key)),
+            "leads": g["leads"],
+            "with_email": g["with_email"],
+            "email_conversion": round(g["with_email"] / g["leads"], 3) if g["leads"] else None,
+            "builds_done": g["builds_done"],
+            "builds_error": g["builds_error"],
+            "build_success_rate": round(g["builds_done"] / finished, 3) if finished else None,
+            "build_ms_avg": round(g["build_ms_sum"] / g["build_ms_count"]) if g["build_ms_count"] else None,
+            "build_ms_p50": _percentile(g["hist"], 0.5),
+            "build_ms_p90": _percentile(g["hist"], 0.9),
+            "build_ms_p99": _percentile(g["hist"], 0.99),
+        })
+    return result
@@ -0,0 +1,273 @@
+"""Single-pass post-processing for generated preview pages.
+
+One streaming walk over the model output (stdlib HTMLParser) that:
+- strips markdown fences and validates the document structure
+- swaps Unsplash URLs for generated images (first -> hero, last -> secondary)
+- adds loading="lazy" / decoding="async" and width/height to below-the-fold <img>
+- dedupes Google Fonts <link>s and adds preconnect hints
+- drops comments, collapses whitespace and lightly minifies <style> blocks
+- reports the page weight
+"""
+import re
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import parse_qs, urlparse
+
+UNSPLASH_RE = re.compile(r"https://images\.unsplash\.com/[^\s\"')\]>]+")
+FENCE_START_RE = re.compile(r"^```(?:html)?\s*")
+FENCE_END_RE = re.compile(r"\s*```$")
+WS_RE = re.compile(r"\s+")
+CSS_TOKEN_RE = re.compile(r"/\*.*?\*/|\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*'", re.S)
+CSS_PUNCT_RE = re.compile(r"\s*([{};,])\s*")
+CSS_COLON_RE = re.compile(r":\s+")
+
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+PRESERVE_WS_TAGS = {"pre", "textarea", "script", "style"}
+FOLD_TAGS = {"section"}
+FONT_HOSTS = ("https://fonts.googleapis.com", "https://fonts.gstatic.com")
+# Only for the width/height this pass added: they reserve layout space, and the
+# zero-specificity reset lets any page CSS still win
+IMG_SIZE_ATTR = "data-pp-size"
+IMG_SIZE_RESET = f"<style>:where(img[{IMG_SIZE_ATTR}]){{height:auto}}</style>"
+
+
+def _minify_code(css):
+    css = WS_RE.sub(" ", css)
+    css = CSS_PUNCT_RE.sub(r"\1", css)
+    css = CSS_COLON_RE.sub(":", css)
+    return css.replace(";}", "}")
+
+
+def _minify_css(css):
+    # Comments are dropped and quoted strings copied verbatim; only the code between them is collapsed
+    out, code, pos = [], "", 0
+    for m in CSS_TOKEN_RE.finditer(css):
+        code += css[pos:m.start()]
+        pos = m.end()
+        if not m.group(0).startswith("/*"):
+            out += [_minify_code(code), m.group(0)]
+            code = ""
+    out.append(_minify_code(code + css[pos:]))
+    return "".join(out).strip()
+
+
+def _unsplash_size(url):
+    query = parse_qs(urlparse(url).query)
+    w, h = query.get("w", [""])[0], query.get("h", [""])[0]
+    if w.isdigit() and h.isdigit():
+        return w, h
+    return None
+
+
+class _PagePostProcessor(HTMLParser):
+    def __init__(self, images):
+        super().__init__(convert_charrefs=False)
+        self.hero_url = images.get("hero", "")
+        self.secondary_url = images.get("secondary", "")
+        self.out = []
+        self.stack = []
+        self.unsplash_seen = []  # (chunk index, url) of Unsplash URLs left in place
+        self.hero_done = False
+        self.fold_closed = False
+        self.sized = {}  # chunk index -> width/height attributes added to that <img>
+        self.reset_idx = None
+        self.font_hrefs = set()
+        self.preconnects = set()
+        self.has_doctype = False
+        self.seen = set()
+        self.report = {"images": 0, "lazy_images": 0, "fonts_deduped": 0, "comments_removed": 0, "repaired": []}
+
+    # -- URL rewriting ----------------------------------------------------
+
+    def _rewrite_urls(self, text):
+        if "images.unsplash.com" not in text:
+            return text
+
+        def swap(m):
+            if self.hero_url and not self.hero_done:
+                self.hero_done = True
+                return self.hero_url
+            self.unsplash_seen.append((len(self.out), m.group(0)))
+            return m.group(0)
+
+        return UNSPLASH_RE.sub(swap, text)
+
+    def _emit(self, text):
+        self.out.append(text)
+
+    # -- tags -------------------------------------------------------------
+
+    def _render_tag(self, tag, attrs, self_closing):
+        parts = [tag]
+        for name, value in attrs:
+            if value is None:
+                parts.append(name)
+            else:
+                parts.append(f'{name}="{escape(value, quote=True)}"')
+        return "<" + " ".join(parts) + (" />" if self_closing else ">")
+
+    def _start(self, tag, attrs, self_closing):
+        self.seen.add(tag)
+        raw = self.get_starttag_text() or ""
+        changed = False
+        attr_map = dict(attrs)
+
+        if tag == "link":
+            rel = (attr_map.get("rel") or "").lower()
+            href = attr_map.get("href") or ""
+            if rel == "preconnect":
+                if href in self.preconnects:
+                    self.report["fonts_deduped"] += 1
+                    return
+                self.preconnects.add(href)
+            elif href.startswith(FONT_HOSTS[0]):
+                if href in self.font_hrefs:
+                    self.report["fonts_deduped"] += 1
+                    return
+                if not self.font_hrefs:
+                    for host in FONT_HOSTS:
+                        if host not in self.preconnects:
+                            self.preconnects.add(host)
+                            cross = " crossorigin" if host == FONT_HOSTS[1] else ""
+                            self._emit(f'<link rel="preconnect" href="{host}"{cross}>')
+                self.font_hrefs.add(href)
+
+        if tag == "img":
+            self.report["images"] += 1
+            src = attr_map.get("src") or ""
+            # The image that gets the generated hero is the LCP element: never lazy, never resized
+            gets_hero = bool(self.hero_url) and not self.hero_done and bool(UNSPLASH_RE.search(src))
+            if self.fold_closed and not gets_hero:
+                if "loading" not in attr_map:
+                    attrs = attrs + [("loading", "lazy")]
+                    self.report["lazy_images"] += 1
+                    changed = True
+                if "decoding" not in attr_map:
+                    attrs = attrs + [("decoding", "async")]
+                    changed = True
+                size = _unsplash_size(src) if "width" not in attr_map and "height" not in attr_map else None
+                if size:
+                    attrs = attrs + [("width", size[0]), ("height", size[1]), (IMG_SIZE_ATTR, None)]
+                    self.sized[len(self.out)] = f' width="{size[0]}" height="{size[1]}" {IMG_SIZE_ATTR}'
+                    changed = True
+
+        text = self._render_tag(tag, attrs, self_closing) if changed else raw
+        text = self._rewrite_urls(text)
+        self._emit(text)
+        if not self_closing and tag not in VOID_TAGS:
+            self.stack.append(tag)
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs, False)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs, True)
+
+    def handle_endtag(self, tag):
+        if tag in VOID_TAGS:
+            return
+        if tag in self.stack:
+            while self.stack:
+                if self.stack.pop() == tag:
+                    break
+        if tag in FOLD_TAGS:
+            self.fold_closed = True
+        if tag == "head":
+            self.reset_idx = len(self.out)
+            self._emit("")  # IMG_SIZE_RESET, filled in by result() if any <img> was sized
+        self._emit(f"</{tag}>")
+
+    # -- content ----------------------------------------------------------
+
+    def handle_data(self, data):
+        top = self.stack[-1] if self.stack else ""
+        if top == "style":
+            data = _minify_css(data)
+        elif top not in PRESERVE_WS_TAGS:
+            if not data.strip():
+                data = "" if top in ("", "html", "head") else " "
+            else:
+                data = WS_RE.sub(" ", data)
+        if data:
+            data = self._rewrite_urls(data)
+            self._emit(data)
+
+    def handle_entityref(self, name):
+        self._emit(f"&{name};")
+
+    def handle_charref(self, name):
+        self._emit(f"&#{name};")
+
+    def handle_comment(self, data):
+        if data.strip().startswith("[if"):
+            self._emit(f"<!--{data}-->")
+        else:
+            self.report["comments_removed"] += 1
+
+    def handle_decl(self, decl):
+        if decl.lower().startswith("doctype"):
+            self.has_doctype = True
+            self._emit("<!DOCTYPE html>")
+        else:
+            self._emit(f"<!{decl}>")
+
+    def unknown_decl(self, data):
+        self._emit(f"<![{data}]>")
+
+    def handle_pi(self, data):
+        self._emit(f"<?{data}>")
+
+    # -- finish -----------------------------------------------------------
+
+    def close(self):
+        # Output cut off mid-tag (`<div class="trunc`) is left unparsed; drop it instead of emitting it as text
+        if self.rawdata.lstrip().startswith("<"):
+            self.rawdata = ""
+        super().close()
+
+    def result(self):
+        if self.secondary_url and self.unsplash_seen:
+            idx, url = self.unsplash_seen[-1]
+            if idx in self.sized:
+                # The Unsplash w/h says nothing about the generated image's aspect ratio
+                self.out[idx] = self.out[idx].replace(self.sized.pop(idx), "", 1)
+            head, sep, tail = self.out[idx].rpartition(url)
+            self.out[idx] = head + self.secondary_url + tail
+        if self.sized:
+            if self.reset_idx is not None:
+                self.out[self.reset_idx] = IMG_SIZE_RESET
+            else:
+                self.out.append(IMG_SIZE_RESET)
+        # Truncated output (max_tokens hit) — close whatever is still open
+        while self.stack:
+            tag = self.stack.pop()
+            self.report["repaired"].append(tag)
+            self.out.append(f"</{tag}>")
+        return "".join(self.out)
+
+
+def process_page(raw_html, images=None):
+    """Validate and optimize a generated page in one pass.
+
+    Returns (html, report); html is None when the output is not a usable document.
+    """
+    text = FENCE_END_RE.sub("", FENCE_START_RE.sub("", (raw_html or "").strip()))
+    report = {"bytes_in": len(text.encode("utf-8")), "bytes_out": 0, "valid": False}
+    if not text:
+        return None, report
+
+    parser = _PagePostProcessor(images or {})
+    try:
+        parser.feed(text)
+        parser.close()
+    except Exception as e:
+        report["error"] = str(e)
+        return None, report
+    html = parser.result()
+    report.update(parser.report)
+
+    if not parser.has_doctype or "body" not in parser.seen:
+        return None, report
+    report["valid"] = True
+    report["bytes_out"] = len(html.encode("utf-8"))
+    return html, report
@@ -0,0 +1,277 @@
+"""Instant template previews rendered from the themes and demo templates in index.html.
+
+index.html is the single source of truth for the 12 `styles[]` themes, the
+restaurant/nightclub/e-commerce `industries` templates and the vibe -> style
+mapping. They are read out of the page's script once (cached by mtime) and a
+complete preview page is assembled from them plus the lead fields in well
+under a millisecond, so the visitor has something to look at while the LLM
+build runs.
+"""
+import json
+import os
+import re
+import threading
+from html import escape
+
+JS_CONSTS = ("styles", "industries", "vibeStyleMap", "typeTemplateMap")
+
+# vibeStyleMap in index.html names a few themes that are not in styles[]
+VIBE_FALLBACK_STYLES = {
+    "Warm & Elegant": "Haute Couture",
+    "Dark & Bold": "Midnight Studio",
+    "Clean & Minimal": "Swiss",
+    "Loud & Electric": "Cosmos",
+    "Playful & Fun": "Fiesta",
+    "Raw & Edgy": "Brutalist",
+}
+
+TYPE_KEYWORDS = [
+    ("restaurant", ("restaurant", "cafe", "café", "bistro", "bakery", "food", "dining", "kitchen", "catering", "pizzeria", "brasserie")),
+    ("nightclub", ("club", "bar", "night", "lounge", "pub", "cocktail", "venue", "dj", "festival")),
+    ("ecommerce", ("store", "shop", "ecommerce", "e-commerce", "boutique", "fashion", "retail", "brand")),
+]
+
+# Hero photo for types none of the demo templates fit
+NEUTRAL_HERO_IMAGE = "https://images.unsplash.com/photo-1497366216548-37526070297c?w=1200&h=800&fit=crop&auto=format&q=80"
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _js_literal_to_json(src):
+    """Convert the JS object/array literals used in index.html to JSON text.
+
+    Handles '...', "..." and `...` strings, // and /* */ comments, bare keys
+    and trailing commas — enough for the plain data literals in the page.
+    """
+    out = []
+    i, n = 0, len(src)
+    while i < n:
+        c = src[i]
+        if c in "'\"`":
+            j = i + 1
+            buf = []
+            while src[j] != c:
+                if src[j] == "\\":
+                    nxt = src[j + 1]
+                    buf.append({"n": "\n", "t": "\t"}.get(nxt, nxt))
+                    j += 2
+                    continue
+                buf.append(src[j])
+                j += 1
+            out.append(json.dumps("".join(buf)))
+            i = j + 1
+        elif src.startswith("//", i):
+            i = src.index("\n", i)
+        elif src.startswith("/*", i):
+            i = src.index("*/", i) + 2
+        elif c.isalpha() or c in "_$":
+            m = re.match(r"[A-Za-z_$][\w$]*", src[i:])
+            word = m.group(0)
+            rest = src[i + len(word):].lstrip()
+            out.append(json.dumps(word) if rest.startswith(":") else word)
+            i += len(word)
+        elif c in "}]":
+            while out and out[-1].strip() == "":
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            out.append(c)
+            i += 1
+        else:
+            out.append(c)
+            i += 1
+    return "".join(out)
+
+
+def _extract_js_const(source, name):
+    m = re.search(r"\bconst\s+" + re.escape(name) + r"\s*=\s*", source)
+    if not m:
+        raise ValueError(f"const {name} not found in index.html")
+    start = m.end()
+    depth, i = 0, start
+    while True:
+        c = source[i]
+        if c in "'\"`":
+            j = i + 1
+            while source[j] != c:
+                j += 2 if source[j] == "\\" else 1
+            i = j
+        elif c in "{[":
+            depth += 1
+        elif c in "}]":
+            depth -= 1
+            if depth == 0:
+                return source[start:i + 1]
+        i += 1
+
+
+def load_templates(index_path):
+    """Parsed themes/templates from index.html, re-read only when the file changes."""
+    mtime = os.stat(index_path).st_mtime
+    cached = _cache.get(index_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with _cache_lock:
+        cached = _cache.get(index_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(index_path, encoding="utf-8") as f:
+            source = f.read()
+        templates = {name: json.loads(_js_literal_to_json(_extract_js_const(source, name))) for name in JS_CONSTS}
+        _cache[index_path] = (mtime, templates)
+        return templates
+
+
+def pick_style(templates, vibe):
+    by_name = {s["name"]: s for s in templates["styles"]}
+    for name in (templates["vibeStyleMap"].get(vibe), VIBE_FALLBACK_STYLES.get(vibe)):
+        if name in by_name:
+            return by_name[name]
+    return templates["styles"][0]
+
+
+def pick_industry(templates, biz_type):
+    """The demo template for a business type, or None when none of them fits (plumber, dentist, ...).
+
+    typeTemplateMap sends "Other" to the e-commerce demo on the page; here only a
+    real match counts, so a consultant never gets a web-shop pitch.
+    """
+    key = templates["typeTemplateMap"].get(biz_type) if biz_type != "Other" else None
+    if not key:
+        lowered = (biz_type or "").lower()
+        key = next((k for k, words in TYPE_KEYWORDS if any(re.search(rf"\b{re.escape(w)}\b", lowered) for w in words)), None)
+    return templates["industries"][key] if key else None
+
+
+def _neutral_industry(lead):
+    """Industry-shaped content built from the lead's own services/audience, with neutral copy."""
+    biz_type = (lead.get("type") or "").strip()
+    intro = f"{biz_type[:1].upper()}{biz_type[1:]} — get in touch to find out more." if biz_type not in ("", "Other") else "Get in touch to find out more."
+    services = [x.strip() for x in re.split(r"[,;\n]|\band\b", lead.get("services") or "") if x.strip()]
+    cards = "".join(f'<div class="demo-feature"><strong>{escape(x)}</strong></div>' for x in services[:6])
+    audience = lead.get("audience") or ""
+    features = lead.get("features") or ""
+    return {
+        "topbarName": "",
+        "heroImage": NEUTRAL_HERO_IMAGE,
+        "content": {
+            "intro": {"body": intro},
+            "websites": {"label": "Services", "detail": f'<div class="demo-features">{cards}</div>' if cards else ""},
+            "automations": {"label": "About", "heading": "Who we work with", "body": audience,
+                            "detail": f'<p class="body">{escape(features)}</p>' if features else ""},
+            "stack": {"label": "", "detail": ""},
+        },
+    }
+
+
+def _hex_rgb(color):
+    if not color or not color.startswith("#"):
+        return None
+    h = color[1:]
+    if len(h) == 3:
+        h = "".join(ch * 2 for ch in h)
+    try:
+        return tuple(int(h[k:k + 2], 16) for k in (0, 2, 4))
+    except ValueError:
+        return None
+
+
+def _rgba(color, alpha):
+    rgb = _hex_rgb(color) or (0, 0, 0)
+    return f"rgba({rgb[0]},{rgb[1]},{rgb[2]},{alpha})"
+
+
+def _is_light(color):
+    rgb = _hex_rgb(color)
+    return bool(rgb) and (rgb[0] * 299 + rgb[1] * 587 + rgb[2] * 114) / 1000 > 150
+
+
+def render_template_preview(lead, templates):
+    """Assemble a standalone preview page for a lead from a theme and an industry template."""
+    style = pick_style(templates, lead.get("vibe", ""))
+    matched = pick_industry(templates, lead.get("type", ""))
+    industry = matched or _neutral_industry(lead)
+    content = industry["content"]
+
+    raw_biz = lead.get("business") or "Your business"
+    biz = escape(raw_biz)
+    demo_name = re.compile(re.escape(industry["topbarName"]), re.I) if industry["topbarName"] else None
+
+    def personalize(html_fragment):
+        return demo_name.sub(lambda _: biz, html_fragment or "") if demo_name else html_fragment or ""
+
+    def personalize_text(text):
+        return escape(demo_name.sub(lambda _: raw_biz, text or "") if demo_name else text or "")
+
+    def section(label, body_html):
+        # Sections the content leaves empty (neutral previews with few details) are left out
+        return f'<section>\n<div class="label">{escape(label)}</div>\n{body_html}\n</section>' if body_html.strip() else ""
+
+    bg = style["bg"] if style["bg"].startswith("#") else "#0d0221"
+    fg, accent, body_color = style["fg"], style["accent"], style["bodyColor"]
+    h_font, b_font = style["headlineFont"], style["bodyFont"]
+    on_accent = "#111" if _is_light(accent) else "#fff"
+    fonts = "&".join(f"family={f.replace(' ', '+')}:wght@400;600;700;900" for f in dict.fromkeys([h_font, b_font]))
+
+    tagline = lead.get("tagline")
+    hero_sub = escape(tagline) if tagline else personalize_text(content["intro"]["body"])
+    services = lead.get("services")
+    # The neutral content already lays the services out as cards
+    services_html = f'<p class="body">{escape(services)}</p>' if services and matched else ""
+    owner = lead.get("name")
+    built_for = f"Built for {escape(owner)}. " if owner else ""
+
+    return f"""<!DOCTYPE html>
+<html lang="en"><head><meta charset="UTF-8"><meta name="viewport" content="width=device-width,initial-scale=1">
+<title>{biz}</title>
+<link href="https://fonts.googleapis.com/css2?{fonts}&display=swap" rel="stylesheet">
+<style>
+*,*::before,*::after{{margin:0;padding:0;box-sizing:border-box}}
+html{{scroll-behavior:smooth}}
+body{{background:{bg};color:{fg};font-family:'{b_font}',sans-serif;min-height:100vh}}
+.hero{{position:relative;min-height:90vh;display:flex;flex-direction:column;justify-content:flex-end;padding:48px 24px;overflow:hidden}}
+.hero-bg{{position:absolute;inset:0;background:url('{industry.get("heroImage", "")}') center/cover no-repeat}}
+.hero-ov{{position:absolute;inset:0;background:linear-gradient(180deg,{_rgba(bg, 0.3)} 0%,{_rgba(bg, 0.92)} 100%)}}
+.hero *{{position:relative;z-index:1}}
+.hero h1{{font-family:'{h_font}',sans-serif;font-size:{style.get("headlineSize", "clamp(2rem,6vw,3.5rem)")};font-weight:{style.get("headlineWeight", 700)};line-height:1.1;margin-bottom:12px}}
+.hero p{{font-size:0.95rem;opacity:0.75;max-width:500px;line-height:1.6}}
+.btn{{display:inline-block;margin-top:20px;padding:14px 32px;background:{accent};color:{on_accent};font-family:'{h_font}',sans-serif;font-weight:700;font-size:0.9rem;border-radius:999px;text-decoration:none}}
+section{{max-width:760px;margin:0 auto;padding:80px 24px}}
+.label{{font-size:0.75rem;letter-spacing:0.12em;text-transform:uppercase;color:{accent};margin-bottom:12px}}
+h2{{font-family:'{h_font}',sans-serif;font-size:clamp(1.5rem,4vw,2.5rem);font-weight:700;margin-bottom:16px}}
+p.body{{color:{body_color};line-height:1.7;font-size:0.95rem;margin-bottom:12px}}
+.demo-features{{display:grid;grid-template-columns:1fr 1fr;gap:12px;margin-top:24px}}
+.demo-feature{{padding:16px;border-radius:8px;border:{style.get("cardBorder", "none")};background:{style.get("cardBg", "transparent")}}}
+.demo-feature strong{{display:block;margin-bottom:4px;font-size:0.85rem;color:{accent};font-family:'{h_font}',sans-serif}}
+.demo-feature p{{font-size:0.8rem;color:{body_color};line-height:1.5}}
+.demo-menu-cat{{margin-bottom:28px}}
+.demo-menu-cat h3{{font-family:'{h_font}',sans-serif;color:{accent};margin-bottom:12px}}
+.demo-menu-item{{display:flex;justify-content:space-between;padding:12px 0;border-bottom:1px solid {_rgba(fg, 0.1)}}}
+.demo-dish-info{{flex:1;margin-right:16px}}
+.demo-dish-name{{font-weight:600}}
+.demo-dish-desc{{font-size:0.8rem;color:{body_color};margin-top:4px;line-height:1.5}}
+.demo-dish-price{{color:{accent};white-space:nowrap}}
+.demo-img{{height:260px;border-radius:8px;background-size:cover;background-position:center;margin-bottom:24px}}
+.demo-hint{{font-size:0.8rem;opacity:0.6;margin-top:12px}}
+.cta{{text-align:center;padding:100px 24px}}
+.cta p{{color:{body_color};margin:0 auto 24px;max-width:500px;line-height:1.7}}
+footer{{text-align:center;padding:32px 24px;font-size:0.8rem;color:{body_color};border-top:1px solid {_rgba(fg, 0.1)}}}
+@media(max-width:480px){{.demo-features{{grid-template-columns:1fr}}}}
+</style></head><body>
+<header class="hero">
+<div class="hero-bg"></div><div class="hero-ov"></div>
+<h1>{biz}</h1>
+<p>{hero_sub}</p>
+<a href="#contact" class="btn">Get started →</a>
+</header>
+{section(content["websites"].get("label", ""), services_html + personalize(content["websites"].get("detail", "")))}
+{section(content["automations"].get("label", ""), (f'<h2>{escape(content["automations"].get("heading", "What we do"))}</h2><p class="body">{personalize_text(content["automations"]["body"])}</p>' if content["automations"].get("body") else "") + personalize(content["automations"].get("detail", "")))}
+{section(content["stack"].get("label", ""), personalize(content["stack"].get("detail", "")))}
+<div class="cta" id="contact">
+<h2>This could be {biz}.</h2>
+<p>{built_for}The full site, the automations, the smart systems — built in days. One person. The whole thing.</p>
+<a href="#" class="btn" onclick="return false">Let's make it real →</a>
+</div>
+<footer>{biz} · Preview by Tobias Bouw</footer>
+</body></html>"""
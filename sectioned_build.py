@@ -0,0 +1,361 @@
+"""Sectioned page generation: one small planning call, then sections in parallel.
+
+The planning call fixes the design tokens (palette, fonts, radius, spacing,
+copy direction) for the lead and vibe. The server turns those tokens into one
+shared stylesheet, the hero/services/features/CTA/footer sections are
+generated concurrently against it, and the fragments are assembled into a
+single document. Build wall-clock time then tracks the slowest section rather
+than one long 8192-token completion.
+
+Model calls go through a `complete(prompt, max_tokens, name)` callable supplied
+by server.py, so this module has no client or tracing of its own.
+"""
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from html import escape
+
+PLAN_PROMPT = """You are the art director for a one-page business website. Fix the design system before the sections are built.
+
+Business: {business}
+Type: {type}
+Vibe/Style: {vibe}
+Tagline: {tagline}
+Colors: {colors}
+Services: {services}
+Target Audience: {audience}
+
+Respond with ONLY a JSON object:
+{{
+  "bg": "page background hex",
+  "surface": "card/section alt background hex or rgba",
+  "fg": "main text hex",
+  "muted": "secondary text hex or rgba",
+  "accent": "accent hex",
+  "accentFg": "text color on accent hex",
+  "headlineFont": "Google Font family name",
+  "bodyFont": "Google Font family name",
+  "radius": "CSS length for corners, e.g. 0px, 8px, 24px",
+  "spacing": "section vertical padding CSS length, e.g. 96px",
+  "headlineWeight": 400-900,
+  "tone": "one sentence describing the copywriting voice",
+  "heroImageQuery": "2-4 word Unsplash photo theme"
+}}
+Honor their brand colors if provided. No markdown, no code fences."""
+
+SECTION_PROMPT = """You are building ONE section of a one-page website. Other sections are built in parallel by other designers using the same design system, so stick to it exactly.
+
+Business: {business}
+Type: {type}
+Vibe/Style: {vibe}
+Owner: {name}
+Email: {email}
+Tagline: {tagline}
+Services: {services}
+Target Audience: {audience}
+Features: {features}
+Copy voice: {tone}
+
+SHARED DESIGN SYSTEM (already defined in the page stylesheet — use it, do not redefine it):
+- CSS variables: --bg, --surface, --fg, --muted, --accent, --accent-fg, --radius, --space, --font-head, --font-body
+- Classes: .container (centered max-width wrapper), .eyebrow (small label), .btn (accent button), .btn-ghost, .grid (responsive auto-fit grid), .card (surface card)
+- h1/h2/h3 already use --font-head; body text uses --font-body
+
+YOUR SECTION: {brief}
+
+Output ONLY:
+1. Optionally one <style> block whose selectors ALL start with #{key}
+2. Exactly one <{tag} id="{key}"> element containing the section
+
+No <html>, <head>, <body>, <nav> or <script>. No markdown, no code fences, no explanations."""
+
+SECTIONS = [
+    ("hero", "section", "Hero: full-viewport intro with a background photo from Unsplash (https://images.unsplash.com/photo-...?w=1200&h=800&fit=crop) matching '{image_query}', a dark/light overlay for legibility, the business name as h1, the tagline (or a strong one-liner) as subtitle, and a .btn linking to #cta.", 1600),
+    ("services", "section", "{services_brief} Use a .grid of .card items with real-sounding names, one-line descriptions and (if it fits the business) prices. Include one supporting Unsplash image (https://images.unsplash.com/photo-...?w=800&h=600&fit=crop).", 2200),
+    ("features", "section", "Why choose us / features: 3-4 concrete differentiators for this business and audience, with simple inline SVG or CSS icons, hover effects and transitions.", 1800),
+    ("cta", "section", "Call to action: a bold closing section inviting visitors to book/order/contact, with a .btn using the email address as a mailto link if provided.", 1200),
+    ("footer", "footer", "Footer: business name, short tagline, contact details (email if provided), opening hours or service area if plausible, and small copyright line.", 1000),
+]
+
+DEFAULT_TOKENS = {
+    "bg": "#0a0a0a", "surface": "rgba(255,255,255,0.04)", "fg": "#f0f0f0", "muted": "#9a9a9a",
+    "accent": "#d4a574", "accentFg": "#111111", "headlineFont": "Syne", "bodyFont": "Familjen Grotesk",
+    "radius": "12px", "spacing": "96px", "headlineWeight": 700,
+    "tone": "Confident, warm and concise.", "heroImageQuery": "modern business",
+}
+
+SAFE_VALUE_RE = re.compile(r"^[#\w\s.,()%+-]+$")
+FENCE_RE = re.compile(r"^```(?:html|json)?\s*|\s*```$")
+STYLE_RE = re.compile(r"<style[^>]*>(.*?)</style>", re.S | re.I)
+CSS_COMMENT_RE = re.compile(r"/\*.*?\*/", re.S)
+NESTED_AT_RULES = ("@media", "@supports", "@container")
+VERBATIM_AT_RULES = ("@keyframes", "@-webkit-keyframes", "@font-face")
+BODY_RE = re.compile(r"<body[^>]*>(.*)</body>", re.S | re.I)
+STRIP_TAGS_RE = re.compile(r"</?(?:html|head|body|nav)\b[^>]*>|<!DOCTYPE[^>]*>|<script.*?</script>|<meta[^>]*>|<link[^>]*>|<title>.*?</title>", re.S | re.I)
+
+
+def _clean(text):
+    return FENCE_RE.sub("", (text or "").strip())
+
+
+def _is_light(color):
+    h = (color or "").lstrip("#")
+    if len(h) == 3:
+        h = "".join(ch * 2 for ch in h)
+    if len(h) != 6 or not color.startswith("#"):
+        return False
+    try:
+        r, g, b = (int(h[i:i + 2], 16) for i in (0, 2, 4))
+    except ValueError:
+        return False
+    return (r * 299 + g * 587 + b * 114) / 1000 > 150
+
+
+def tokens_from_style(style):
+    """Design tokens from one of index.html's styles[] themes (planning fallback)."""
+    if not style:
+        return dict(DEFAULT_TOKENS)
+    tokens = dict(DEFAULT_TOKENS)
+    bg = style.get("bg", "")
+    tokens.update({
+        "bg": bg if bg.startswith("#") else DEFAULT_TOKENS["bg"],
+        "fg": style.get("fg", tokens["fg"]),
+        "muted": style.get("bodyColor", tokens["muted"]),
+        "accent": style.get("accent", tokens["accent"]),
+        "surface": style.get("cardBg") if style.get("cardBg") not in (None, "transparent") else tokens["surface"],
+        "headlineFont": style.get("headlineFont", tokens["headlineFont"]),
+        "bodyFont": style.get("bodyFont", tokens["bodyFont"]),
+        "headlineWeight": style.get("headlineWeight", tokens["headlineWeight"]),
+    })
+    tokens["accentFg"] = "#111111" if _is_light(tokens["accent"]) else "#ffffff"
+    return tokens
+
+
+def parse_plan(raw, fallback):
+    """Merge the planner's JSON over the fallback tokens, keeping only CSS-safe values."""
+    tokens = dict(fallback)
+    try:
+        plan = json.loads(_clean(raw))
+    except (TypeError, ValueError):
+        return tokens
+    if not isinstance(plan, dict):
+        return tokens
+    for key in DEFAULT_TOKENS:
+        value = plan.get(key)
+        if key == "headlineWeight":
+            if isinstance(value, int) and 100 <= value <= 900:
+                tokens[key] = value
+        elif key in ("tone", "heroImageQuery"):
+            if isinstance(value, str) and value.strip():
+                tokens[key] = value.strip()[:200]
+        elif isinstance(value, str) and value.strip() and SAFE_VALUE_RE.match(value.strip()):
+            tokens[key] = value.strip()
+    return tokens
+
+
+def shared_stylesheet(t):
+    return f""":root{{--bg:{t['bg']};--surface:{t['surface']};--fg:{t['fg']};--muted:{t['muted']};--accent:{t['accent']};--accent-fg:{t['accentFg']};--radius:{t['radius']};--space:{t['spacing']};--font-head:'{t['headlineFont']}',serif;--font-body:'{t['bodyFont']}',sans-serif}}
+*,*::before,*::after{{margin:0;padding:0;box-sizing:border-box}}
+html{{scroll-behavior:smooth}}
+body{{background:var(--bg);color:var(--fg);font-family:var(--font-body);line-height:1.6;-webkit-font-smoothing:antialiased}}
+img{{max-width:100%;display:block}}
+a{{color:inherit}}
+h1,h2,h3{{font-family:var(--font-head);font-weight:{t['headlineWeight']};line-height:1.1}}
+h1{{font-size:clamp(2.4rem,7vw,4.5rem)}}
+h2{{font-size:clamp(1.8rem,4.5vw,3rem);margin-bottom:16px}}
+h3{{font-size:1.2rem;margin-bottom:8px}}
+p{{color:var(--muted)}}
+section,footer{{padding:var(--space) 0}}
+.container{{width:min(1120px,100% - 48px);margin:0 auto}}
+.eyebrow{{font-size:0.75rem;letter-spacing:0.14em;text-transform:uppercase;color:var(--accent);margin-bottom:12px}}
+.btn{{display:inline-block;padding:14px 32px;background:var(--accent);color:var(--accent-fg);border-radius:var(--radius);font-weight:700;text-decoration:none;transition:transform .2s,box-shadow .2s}}
+.btn:hover{{transform:translateY(-2px);box-shadow:0 10px 30px rgba(0,0,0,.2)}}
+.btn-ghost{{display:inline-block;padding:13px 31px;border:1px solid var(--accent);color:var(--fg);border-radius:var(--radius);text-decoration:none}}
+.grid{{display:grid;grid-template-columns:repeat(auto-fit,minmax(240px,1fr));gap:24px}}
+.card{{background:var(--surface);border-radius:var(--radius);padding:28px;transition:transform .2s}}
+.card:hover{{transform:translateY(-4px)}}
+.site-nav{{position:sticky;top:0;z-index:50;background:var(--bg);border-bottom:1px solid rgba(127,127,127,.15)}}
+.site-nav .container{{display:flex;align-items:center;justify-content:space-between;height:64px}}
+.site-nav .brand{{font-family:var(--font-head);font-weight:{t['headlineWeight']};text-decoration:none;font-size:1.15rem}}
+.site-nav ul{{display:flex;gap:24px;list-style:none}}
+.site-nav ul a{{text-decoration:none;font-size:0.9rem;color:var(--muted)}}
+.site-nav ul a:hover{{color:var(--accent)}}
+@media(max-width:640px){{.site-nav ul{{display:none}}}}"""
+
+
+def _nav(business, keys):
+    links = [("services", "Services"), ("features", "Why us"), ("cta", "Contact")]
+    items = "".join(f'<li><a href="#{key}">{label}</a></li>' for key, label in links if key in keys)
+    return f'<nav class="site-nav"><div class="container"><a class="brand" href="#hero">{escape(business)}</a><ul>{items}</ul></div></nav>'
+
+
+def _fallback_section(key, lead):
+    business = escape(lead.get("business") or "Our business")
+    tagline = escape(lead.get("tagline") or "")
+    email = escape(lead.get("email") or "")
+    if key == "hero":
+        return f'<section id="hero"><div class="container"><h1>{business}</h1><p>{tagline}</p><a class="btn" href="#cta">Get in touch</a></div></section>'
+    if key == "cta":
+        contact = f'<a class="btn" href="mailto:{email}">Contact us</a>' if email else '<a class="btn" href="#">Contact us</a>'
+        return f'<section id="cta"><div class="container"><h2>Ready when you are.</h2>{contact}</div></section>'
+    if key == "footer":
+        return f'<footer id="footer"><div class="container"><p>{business}{" · " + email if email else ""}</p></div></footer>'
+    return ""
+
+
+def _split_selectors(prelude):
+    parts, depth, start = [], 0, 0
+    for i, c in enumerate(prelude):
+        if c in "([":
+            depth += 1
+        elif c in ")]":
+            depth -= 1
+        elif c == "," and depth == 0:
+            parts.append(prelude[start:i])
+            start = i + 1
+    parts.append(prelude[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+def _block_end(css, open_brace):
+    depth = 0
+    for i in range(open_brace, len(css)):
+        if css[i] == "{":
+            depth += 1
+        elif css[i] == "}":
+            depth -= 1
+            if depth == 0:
+                return i
+    return len(css)
+
+
+def scope_css(css, key):
+    """Prefix every selector of a section's CSS with #key so it cannot restyle the rest of the page.
+
+    @media/@supports/@container are scoped recursively, @keyframes/@font-face
+    kept as they are, and any other at-rule (@import, @page, ...) dropped.
+    """
+    css = CSS_COMMENT_RE.sub("", css)
+    scoped_re = re.compile(rf"[\w-]*#{re.escape(key)}(?![\w-])")  # #hero, section#hero
+    out, i = [], 0
+    while True:
+        brace = css.find("{", i)
+        if brace < 0:
+            break
+        end = _block_end(css, brace)
+        prelude = css[i:brace].rpartition(";")[2].strip()
+        body = css[brace + 1:end]
+        i = end + 1
+        if prelude.startswith("@"):
+            at_rule = prelude.split(None, 1)[0].lower()
+            if at_rule in NESTED_AT_RULES:
+                out.append(f"{prelude}{{{scope_css(body, key)}}}")
+            elif at_rule in VERBATIM_AT_RULES:
+                out.append(f"{prelude}{{{body}}}")
+            continue
+        selectors = [sel if scoped_re.match(sel) else f"#{key} {sel}" for sel in _split_selectors(prelude)]
+        if selectors:
+            out.append(f"{','.join(selectors)}{{{body}}}")
+    return "\n".join(out)
+
+
+def split_fragment(raw, key):
+    """(scoped css, markup) from a section completion, dropping any document wrapper."""
+    text = _clean(raw)
+    body = BODY_RE.search(text)
+    styles = scope_css("\n".join(m.group(1) for m in STYLE_RE.finditer(text)), key)
+    markup = body.group(1) if body else STYLE_RE.sub("", text)
+    markup = STRIP_TAGS_RE.sub("", STYLE_RE.sub("", markup)).strip()
+    if f'id="{key}"' not in markup and f"id='{key}'" not in markup:
+        return styles, ""
+    return styles, markup
+
+
+def build_sectioned_page(lead, complete, fallback_style=None, max_parallel=5, cancel=None):
+    """Plan tokens, generate sections concurrently, assemble one document. Returns raw HTML.
+
+    `cancel` is an optional threading.Event; once it is set, errors raised by
+    `complete` propagate instead of falling back, so a superseded build stops.
+    """
+
+    def cancelled():
+        return cancel is not None and cancel.is_set()
+
+    fields = {k: lead.get(k, "") for k in ("business", "type", "vibe", "name", "email", "tagline", "colors", "services", "audience", "features")}
+    fields["business"] = fields["business"] or "Business"
+
+    fallback = tokens_from_style(fallback_style)
+    try:
+        tokens = parse_plan(complete(PLAN_PROMPT.format(**fields), 600, "model.plan"), fallback)
+    except Exception as e:
+        if cancelled():
+            raise
+        print(f"[build] Planning call failed, using theme tokens: {e}")
+        tokens = fallback
+
+    biz_type = (fields["type"] or "").lower()
+
+    def mentions(*words):
+        return any(re.search(rf"\b{re.escape(w)}\b", biz_type) for w in words)
+
+    if mentions("restaurant", "cafe", "café", "bistro", "bakery", "bar", "food", "kitchen"):
+        services_brief = "Menu: 2-3 categories of signature dishes/drinks."
+    elif mentions("shop", "store", "boutique", "commerce"):
+        services_brief = "Featured products: 4-6 product cards with prices and an 'Add to cart' style button."
+    else:
+        services_brief = "Services: 3-6 key offerings."
+
+    def run(section):
+        key, tag, brief, max_tokens = section
+        prompt = SECTION_PROMPT.format(
+            **fields, tone=tokens["tone"], key=key, tag=tag,
+            brief=brief.format(image_query=tokens["heroImageQuery"], services_brief=services_brief),
+        )
+        try:
+            return split_fragment(complete(prompt, max_tokens, f"model.section.{key}"), key)
+        except Exception as e:
+            if cancelled():
+                raise
+            print(f"[build] Section {key} failed: {e}")
+            return "", ""
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(SECTIONS)))) as executor:
+        results = list(executor.map(run, SECTIONS))
+
+    built = {key for (key, _, _, _), (_, markup) in zip(SECTIONS, results) if markup}
+    if not built or not built & {"hero", "services"}:
+        # Stubs only fill gaps in a real build; a page of nothing but stubs is a failed build
+        print(f"[build] Model returned {len(built)}/{len(SECTIONS)} sections, none of hero/services; giving up")
+        return ""
+
+    section_css, parts, keys = [], [], set()
+    for (key, _, _, _), (css, markup) in zip(SECTIONS, results):
+        markup = markup or _fallback_section(key, lead)
+        if not markup:
+            continue
+        if css:
+            section_css.append(css)
+        parts.append(markup)
+        keys.add(key)
+    if not parts:
+        return ""
+
+    fonts = "&".join(f"family={f.replace(' ', '+')}:wght@400;600;700;900" for f in dict.fromkeys([tokens["headlineFont"], tokens["bodyFont"]]))
+    business = escape(fields["business"])
+    return f"""<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="UTF-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{business}</title>
+<link href="https://fonts.googleapis.com/css2?{fonts}&display=swap" rel="stylesheet">
+<style>
+{shared_stylesheet(tokens)}
+{chr(10).join(section_css)}
+</style>
+</head>
+<body>
+{_nav(fields["business"], keys)}
+{chr(10).join(parts)}
+</body>
+</html>"""
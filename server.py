@@ -2,37 +2,63 @@ import os
 import json
 import re
 import uuid
+import gzip
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from datetime import datetime
-import pg8000
 from urllib.parse import urlparse
-from flask import Flask, request, jsonify, send_from_directory
-from openai import OpenAI
-try:
-    import gspread
-    from google.oauth2.service_account import Credentials
-    GSPREAD_AVAILABLE = True
-except ImportError as e:
-    print(f"[sheets] gspread not available: {e}")
-    GSPREAD_AVAILABLE = False
+from flask import Flask, Response, request, jsonify, send_from_directory
+import job_trace
+import lead_analytics
+from page_postprocess import process_page
+from preview_templates import load_templates, pick_style, render_template_preview
+from sectioned_build import build_sectioned_page
+
+# openai, pg8000 and gspread are imported lazily so `import server` stays cheap on
+# autoscale cold starts; warmup() pulls them in before gunicorn forks (preload_app).
 
 app = Flask(__name__, static_folder=".", static_url_path="")
 
-# xAI Grok client (OpenAI-compatible)
-xai_client = OpenAI(
-    api_key=os.environ.get("XAI_API_KEY"),
-    base_url="https://api.x.ai/v1",
-)
+_xai_client = None
+_xai_client_lock = threading.Lock()
+
+
+def get_xai_client():
+    """xAI Grok client (OpenAI-compatible), created on first use."""
+    global _xai_client
+    if _xai_client is None:
+        with _xai_client_lock:
+            if _xai_client is None:
+                from openai import OpenAI
+                _xai_client = OpenAI(
+                    api_key=os.environ.get("XAI_API_KEY"),
+                    base_url="https://api.x.ai/v1",
+                )
+    return _xai_client
 
 CHAT_MODEL = "grok-4-1-fast-non-reasoning"
 BUILD_MODEL = "grok-4-1-fast"
 DESIGN_MODEL = "grok-4-1-fast-non-reasoning"
 IMAGE_MODEL = "grok-2-image"
 
+# "sectioned": plan design tokens, then generate page sections in parallel; "single": one full-page completion
+BUILD_MODE = os.environ.get("BUILD_MODE", "sectioned")
+SECTION_CONCURRENCY = int(os.environ.get("BUILD_SECTION_CONCURRENCY", "5"))
+
 DATABASE_URL = os.environ.get("DATABASE_URL")
 
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "4"))
+DB_IDLE_PING_SECONDS = 300
+
+_db_pool = []
+_db_pool_lock = threading.Lock()
+
+
 def get_db():
+    import pg8000
     parsed = urlparse(DATABASE_URL)
     try:
         conn = pg8000.connect(
@@ -55,36 +81,240 @@ def get_db():
     conn.autocommit = True
     return conn
 
-build_jobs = {}
-build_lock = threading.Lock()
+
+def _borrow_db():
+    with _db_pool_lock:
+        entry = _db_pool.pop() if _db_pool else None
+    if entry is None:
+        return get_db()
+    conn, released_at = entry
+    if time.monotonic() - released_at > DB_IDLE_PING_SECONDS:
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+        except Exception:
+            _close_quietly(conn)
+            return get_db()
+    return conn
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+@contextmanager
+def db_connection():
+    """Borrow a pooled connection. Connections that raise are discarded, not returned."""
+    conn = _borrow_db()
+    try:
+        yield conn
+    except Exception:
+        _close_quietly(conn)
+        raise
+    with _db_pool_lock:
+        if len(_db_pool) < DB_POOL_SIZE:
+            _db_pool.append((conn, time.monotonic()))
+            conn = None
+    if conn is not None:
+        _close_quietly(conn)
+
+
+def reset_db_pool():
+    """Drop pooled connections; sockets must never be shared across a fork."""
+    with _db_pool_lock:
+        conns = [c for c, _ in _db_pool]
+        _db_pool.clear()
+    for conn in conns:
+        _close_quietly(conn)
+
+JOB_TTL_SECONDS = int(os.environ.get("BUILD_JOB_TTL_SECONDS", "3600"))
+JOB_STORE_MAX_BYTES = int(os.environ.get("BUILD_JOB_MAX_BYTES", str(32 * 1024 * 1024)))
+JOB_STORE_MAX_ENTRIES = int(os.environ.get("BUILD_JOB_MAX_ENTRIES", "500"))
+JOB_REAPER_INTERVAL = int(os.environ.get("BUILD_JOB_REAPER_INTERVAL", "60"))
+JOB_ENTRY_OVERHEAD = 512  # rough per-job cost of the dict, keys and bookkeeping
+
+
+def _job_size(job):
+    size = JOB_ENTRY_OVERHEAD + len(job.get("page") or "")
+    for v in (job.get("lead") or {}).values():
+        if isinstance(v, str):
+            size += len(v)
+    return size
+
+
+class BuildJobStore:
+    """In-process build job store bounded by TTL, entry count and a byte budget.
+
+    Jobs are kept in LRU order. Finished jobs that get evicted are reloaded
+    from the leads table when a late status poll asks for them.
+    """
+
+    def __init__(self, max_bytes=JOB_STORE_MAX_BYTES, ttl=JOB_TTL_SECONDS, max_entries=JOB_STORE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.RLock()
+        self._jobs = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._reaper = None
+
+    def __contains__(self, job_id):
+        return self.get(job_id) is not None
+
+    def __len__(self):
+        with self.lock:
+            return len(self._jobs)
+
+    @property
+    def total_bytes(self):
+        with self.lock:
+            return self._bytes
+
+    def create(self, job_id, job):
+        job = dict(job)
+        job["touched_at"] = time.monotonic()
+        with self.lock:
+            self._remove(job_id)
+            self._jobs[job_id] = job
+            self._sizes[job_id] = _job_size(job)
+            self._bytes += self._sizes[job_id]
+            self._evict()
+        self._ensure_reaper()
+
+    def get(self, job_id, reload=True):
+        """Return a snapshot of the job, reloading finished jobs from the DB if evicted."""
+        with self.lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job["touched_at"] = time.monotonic()
+                self._jobs.move_to_end(job_id)
+                return dict(job)
+        if not reload or not job_id:
+            return None
+        job = load_finished_job_from_db(job_id)
+        if job is None:
+            return None
+        self.create(job_id, job)
+        print(f"[jobs] Reloaded job {job_id} from database")
+        return dict(job)
+
+    def update(self, job_id, **fields):
+        """Update fields of a live job. Returns the new snapshot, or None if it was evicted."""
+        with self.lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.update(fields)
+            job["touched_at"] = time.monotonic()
+            self._jobs.move_to_end(job_id)
+            new_size = _job_size(job)
+            self._bytes += new_size - self._sizes[job_id]
+            self._sizes[job_id] = new_size
+            self._evict(keep=job_id)
+            return dict(job)
+
+    def reap(self):
+        cutoff = time.monotonic() - self.ttl
+        with self.lock:
+            expired = [jid for jid, job in self._jobs.items() if job["touched_at"] < cutoff]
+            for jid in expired:
+                self._remove(jid)
+        if expired:
+            print(f"[jobs] Reaped {len(expired)} expired jobs ({len(self._jobs)} left, {self._bytes} bytes)")
+        return len(expired)
+
+    def _remove(self, job_id):
+        if job_id in self._jobs:
+            del self._jobs[job_id]
+            self._bytes -= self._sizes.pop(job_id)
+
+    def _evict(self, keep=None):
+        # Oldest first; jobs that are still building hold no page and are never evicted early
+        for jid in list(self._jobs):
+            if self._bytes <= self.max_bytes and len(self._jobs) <= self.max_entries:
+                break
+            if jid == keep or self._jobs[jid].get("status") == "building":
+                continue
+            self._remove(jid)
+
+    def _ensure_reaper(self):
+        if self._reaper is not None and self._reaper.is_alive():
+            return
+        with self.lock:
+            if self._reaper is not None and self._reaper.is_alive():
+                return
+            self._reaper = threading.Thread(target=self._reap_forever, daemon=True)
+            self._reaper.start()
+
+    def _reap_forever(self):
+        while True:
+            time.sleep(JOB_REAPER_INTERVAL)
+            try:
+                self.reap()
+            except Exception as e:
+                print(f"[jobs] Reaper error: {e}")
+
+
+build_jobs = BuildJobStore()
 
 GOOGLE_SPREADSHEET_ID = os.environ.get("GOOGLE_SPREADSHEET_ID", "")
 SHEET_HEADERS = ["Timestamp", "Job ID", "Status", "Business", "Type", "Vibe", "Email", "Name", "Phone", "Colors", "Tagline", "Services", "Audience", "Features", "Entry Context"]
 
+_gsheet = None
+_gsheet_lock = threading.Lock()
+
+
 def get_gsheet():
-    if not GSPREAD_AVAILABLE:
-        return None
+    global _gsheet
+    if _gsheet is not None:
+        return _gsheet
     sa_json = os.environ.get("GOOGLE_SERVICE_ACCOUNT_JSON", "")
     if not sa_json or not GOOGLE_SPREADSHEET_ID:
         return None
     try:
-        sa_json = sa_json.strip()
-        if not sa_json.endswith("}"):
-            sa_json += "}"
-        creds_dict = json.loads(sa_json)
-        scopes = ["https://www.googleapis.com/auth/spreadsheets"]
-        creds = Credentials.from_service_account_info(creds_dict, scopes=scopes)
-        gc = gspread.authorize(creds)
-        return gc.open_by_key(GOOGLE_SPREADSHEET_ID).sheet1
-    except Exception as e:
-        print(f"[sheets] Error connecting to Google Sheets: {e}")
+        import gspread
+        from google.oauth2.service_account import Credentials
+    except ImportError as e:
+        print(f"[sheets] gspread not available: {e}")
         return None
+    with _gsheet_lock:
+        if _gsheet is not None:
+            return _gsheet
+        try:
+            sa_json = sa_json.strip()
+            if not sa_json.endswith("}"):
+                sa_json += "}"
+            creds_dict = json.loads(sa_json)
+            scopes = ["https://www.googleapis.com/auth/spreadsheets"]
+            creds = Credentials.from_service_account_info(creds_dict, scopes=scopes)
+            gc = gspread.authorize(creds)
+            _gsheet = gc.open_by_key(GOOGLE_SPREADSHEET_ID).sheet1
+            return _gsheet
+        except Exception as e:
+            print(f"[sheets] Error connecting to Google Sheets: {e}")
+            return None
+
+
+def reset_gsheet():
+    global _gsheet
+    with _gsheet_lock:
+        _gsheet = None
 
 def sync_lead_to_sheet(job_id, lead, status="building", entry_context=""):
+    with job_trace.span(job_id, "sheets.sync", lead_status=status) as attrs:
+        attrs["result"] = _sync_lead_to_sheet(job_id, lead, status, entry_context)
+
+
+def _sync_lead_to_sheet(job_id, lead, status, entry_context):
     try:
         sheet = get_gsheet()
         if not sheet:
-            return
+            return "skipped"
         existing = sheet.get_all_values()
         if not existing or existing[0] != SHEET_HEADERS:
             sheet.clear()
@@ -118,11 +348,14 @@ def sync_lead_to_sheet(job_id, lead, status="building", entry_context=""):
         if row_idx:
             sheet.update(f"A{row_idx}:O{row_idx}", [row_data])
             print(f"[sheets] Updated row {row_idx} for job {job_id}")
-        else:
-            sheet.append_row(row_data)
-            print(f"[sheets] Added new row for job {job_id}")
+            return "updated"
+        sheet.append_row(row_data)
+        print(f"[sheets] Added new row for job {job_id}")
+        return "added"
     except Exception as e:
         print(f"[sheets] Error syncing to sheet: {e}")
+        reset_gsheet()
+        return "error"
 
 AVAILABLE_FONTS = [
     "Syne", "Fira Code", "DM Serif Display", "Familjen Grotesk",
@@ -290,62 +523,105 @@ The page should look SO good that the client is blown away. This is a sales tool
 Output ONLY the complete HTML. No explanations, no markdown, no code fences."""
 
 
-def save_lead_to_db(job_id, lead, status="building", page_html=None, entry_context=""):
+def save_lead_to_db(job_id, lead, status="building", page_html=None, entry_context="", sync_sheet=True, generation=None):
+    entry_point = lead_analytics.parse_entry_point(entry_context)
     try:
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute("""
-            INSERT INTO leads (job_id, business, type, vibe, email, name, phone, tagline, colors, services, audience, features, page_html, status, entry_context)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (job_id) DO UPDATE SET
-                business = EXCLUDED.business,
-                type = EXCLUDED.type,
-                vibe = EXCLUDED.vibe,
-                email = EXCLUDED.email,
-                name = EXCLUDED.name,
-                phone = EXCLUDED.phone,
-                tagline = EXCLUDED.tagline,
-                colors = EXCLUDED.colors,
-                services = EXCLUDED.services,
-                audience = EXCLUDED.audience,
-                features = EXCLUDED.features,
-                page_html = EXCLUDED.page_html,
-                status = EXCLUDED.status,
-                entry_context = EXCLUDED.entry_context,
-                updated_at = CURRENT_TIMESTAMP
-        """, (
-            job_id,
-            lead.get("business", ""),
-            lead.get("type", ""),
-            lead.get("vibe", ""),
-            lead.get("email", ""),
-            lead.get("name", ""),
-            lead.get("phone", ""),
-            lead.get("tagline", ""),
-            lead.get("colors", ""),
-            lead.get("services", ""),
-            lead.get("audience", ""),
-            lead.get("features", ""),
-            page_html,
-            status,
-            entry_context,
-        ))
-        conn.commit()
-        cur.close()
-        conn.close()
+        with job_trace.span(job_id, "db.save", lead_status=status, page_bytes=len(page_html or "")):
+            with db_connection() as conn:
+                lead_analytics.ensure_leads_schema(conn)
+                _upsert_lead(conn, job_id, lead, status, page_html, entry_context, entry_point, generation)
+                try:
+                    lead_analytics.record_transition(conn, job_id, lead, status, entry_point)
+                except Exception as e:
+                    print(f"[analytics] Error updating funnel rollups for {job_id}: {e}")
         print(f"[db] Lead saved: {job_id} ({status})")
 
-        sync_thread = threading.Thread(
-            target=sync_lead_to_sheet,
-            args=(job_id, lead, status, entry_context),
-            daemon=True
-        )
-        sync_thread.start()
+        if sync_sheet:
+            sync_thread = threading.Thread(
+                target=sync_lead_to_sheet,
+                args=(job_id, lead, status, entry_context),
+                daemon=True
+            )
+            sync_thread.start()
+        return True
     except Exception as e:
         print(f"[db] Error saving lead: {e}")
+        return False
+
+
+def _upsert_lead(conn, job_id, lead, status, page_html, entry_context, entry_point, generation=None):
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO leads (job_id, business, type, vibe, email, name, phone, tagline, colors, services, audience, features, page_html, status, entry_context, entry_point, generation)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, COALESCE(CAST(%s AS INTEGER), 1))
+        ON CONFLICT (job_id) DO UPDATE SET
+            business = EXCLUDED.business,
+            type = EXCLUDED.type,
+            vibe = EXCLUDED.vibe,
+            email = EXCLUDED.email,
+            name = EXCLUDED.name,
+            phone = EXCLUDED.phone,
+            tagline = EXCLUDED.tagline,
+            colors = EXCLUDED.colors,
+            services = EXCLUDED.services,
+            audience = EXCLUDED.audience,
+            features = EXCLUDED.features,
+            page_html = COALESCE(EXCLUDED.page_html, leads.page_html),
+            status = EXCLUDED.status,
+            entry_context = COALESCE(NULLIF(EXCLUDED.entry_context, ''), leads.entry_context),
+            entry_point = COALESCE(NULLIF(EXCLUDED.entry_point, ''), leads.entry_point),
+            generation = GREATEST(EXCLUDED.generation, COALESCE(leads.generation, 1)),
+            updated_at = CURRENT_TIMESTAMP
+    """, (
+        job_id,
+        lead.get("business", ""),
+        lead.get("type", ""),
+        lead.get("vibe", ""),
+        lead.get("email", ""),
+        lead.get("name", ""),
+        lead.get("phone", ""),
+        lead.get("tagline", ""),
+        lead.get("colors", ""),
+        lead.get("services", ""),
+        lead.get("audience", ""),
+        lead.get("features", ""),
+        page_html,
+        status,
+        entry_context,
+        entry_point,
+        generation,
+    ))
+    cur.close()
+
+
+def load_finished_job_from_db(job_id):
+    try:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT status, page_html, business, type, vibe, email, name, phone, tagline, colors, services, audience, features, generation FROM leads WHERE job_id = %s", (job_id,))
+            row = cur.fetchone()
+            cur.close()
+    except Exception as e:
+        print(f"[db] Error loading job {job_id}: {e}")
+        return None
+    if not row or row[0] != "done" or not row[1]:
+        return None
+    lead_fields = ["business", "type", "vibe", "email", "name", "phone", "tagline", "colors", "services", "audience", "features"]
+    lead = {k: v or "" for k, v in zip(lead_fields, row[2:13])}
+    # The stored page's own revision is not kept; its generation is an upper bound, so a
+    # superseding build (generation + 1) still outranks whatever the client shows
+    generation = row[13] or 1
+    return {
+        "status": "done",
+        "page": row[1],
+        "revision": generation,
+        "generation": generation,
+        "lead": lead,
+        "email_collected": bool(lead["email"]),
+    }
 
 
-def generate_images_for_page(lead):
+def generate_images_for_page(lead, job_id=None, should_stop=None):
     business = lead.get("business", "Business")
     biz_type = lead.get("type", "business")
     vibe = lead.get("vibe", "modern")
@@ -357,13 +633,17 @@ def generate_images_for_page(lead):
 
     images = {}
     for key, prompt in [("hero", hero_prompt), ("secondary", secondary_prompt)]:
+        if should_stop is not None and should_stop():
+            print(f"[images] Stopped before {key} image, the build's image inputs changed")
+            break
         try:
-            response = xai_client.images.generate(
-                model=IMAGE_MODEL,
-                prompt=prompt,
-                n=1,
-                response_format="url",
-            )
+            with job_trace.span(job_id, f"image.{key}", model=IMAGE_MODEL):
+                response = get_xai_client().images.generate(
+                    model=IMAGE_MODEL,
+                    prompt=prompt,
+                    n=1,
+                    response_format="url",
+                )
             url = response.data[0].url
             if url:
                 images[key] = url
@@ -374,7 +654,59 @@ def generate_images_for_page(lead):
     return images
 
 
-def _generate_page_html(lead):
+class BuildCancelled(Exception):
+    """Raised inside a build whose generation was superseded."""
+    cancelled = True  # job_trace records the span as "cancelled", not "error"
+
+
+def _complete(model, prompt, max_tokens, job_id=None, span_name="model.page", cancel=None):
+    """One completion. With a cancel event it streams, so a superseded build stops mid-generation."""
+    with job_trace.span(job_id, span_name, model=model, max_tokens=max_tokens) as attrs:
+        if cancel is None:
+            response = get_xai_client().chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens,
+            )
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                attrs["prompt_tokens"] = usage.prompt_tokens
+                attrs["completion_tokens"] = usage.completion_tokens
+            attrs["finish_reason"] = response.choices[0].finish_reason
+            return response.choices[0].message.content or ""
+
+        if cancel.is_set():
+            raise BuildCancelled("superseded before start")
+        stream = get_xai_client().chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        parts = []
+        try:
+            for chunk in stream:
+                if cancel.is_set():
+                    attrs["streamed_chars"] = sum(len(p) for p in parts)
+                    raise BuildCancelled("superseded mid-generation")
+                usage = getattr(chunk, "usage", None)
+                if usage is not None:
+                    attrs["prompt_tokens"] = usage.prompt_tokens
+                    attrs["completion_tokens"] = usage.completion_tokens
+                if chunk.choices:
+                    parts.append(chunk.choices[0].delta.content or "")
+                    if chunk.choices[0].finish_reason:
+                        attrs["finish_reason"] = chunk.choices[0].finish_reason
+        finally:
+            # Closing the response drops the connection, which ends generation upstream
+            stream.close()
+        return "".join(parts)
+
+
+def _generate_page_html(lead, job_id=None, cancel=None):
+    if BUILD_MODE == "sectioned":
+        return _generate_sectioned_page_html(lead, job_id, cancel)
     prompt = PAGE_BUILD_PROMPT.format(
         business=lead.get("business", "Business"),
         type=lead.get("type", "Other"),
@@ -387,68 +719,189 @@ def _generate_page_html(lead):
         audience=lead.get("audience", ""),
         features=lead.get("features", ""),
     )
-    response = xai_client.chat.completions.create(
-        model=BUILD_MODEL,
-        messages=[{"role": "user", "content": prompt}],
-        max_tokens=8192,
-    )
-    html = response.choices[0].message.content or ""
-    html = re.sub(r"^```(?:html)?\s*", "", html.strip())
-    html = re.sub(r"\s*```$", "", html)
-    if "<!DOCTYPE" not in html.upper():
-        return None
-    return html
-
-
-def _inject_images_into_page(page_html, images):
-    if not page_html or not images:
-        return page_html
-    hero_url = images.get("hero", "")
-    secondary_url = images.get("secondary", "")
-    img_pattern = re.compile(r"https://images\.unsplash\.com/[^\s\"')\]>]+")
-    if hero_url:
-        page_html = img_pattern.sub(hero_url, page_html, count=1)
-    if secondary_url:
-        matches = list(img_pattern.finditer(page_html))
-        if len(matches) >= 1:
-            last = matches[-1]
-            page_html = page_html[:last.start()] + secondary_url + page_html[last.end():]
-    return page_html
-
-
-def build_page_in_background(job_id, lead):
+    return _complete(BUILD_MODEL, prompt, 8192, job_id, cancel=cancel)
+
+
+def _generate_sectioned_page_html(lead, job_id=None, cancel=None):
+    try:
+        fallback_style = pick_style(load_templates(os.path.join(app.root_path, "index.html")), lead.get("vibe", ""))
+    except Exception:
+        fallback_style = None
+
+    def complete(prompt, max_tokens, span_name):
+        # The planner is a small JSON call, so it goes to the fast chat model
+        model = CHAT_MODEL if span_name == "model.plan" else BUILD_MODEL
+        return _complete(model, prompt, max_tokens, job_id, span_name, cancel)
+
+    with job_trace.span(job_id, "model.page", mode="sectioned", sections=SECTION_CONCURRENCY):
+        return build_sectioned_page(lead, complete, fallback_style, max_parallel=SECTION_CONCURRENCY, cancel=cancel)
+
+
+def finalize_page_html(raw_html, images, job_id=None):
+    """Run the single-pass post-processor; returns (page_html or None, report)."""
+    with job_trace.span(job_id, "html.postprocess") as attrs:
+        page_html, report = process_page(raw_html, images)
+        attrs.update({k: report.get(k) for k in ("bytes_in", "bytes_out", "valid", "images", "lazy_images")})
+    if page_html:
+        print(f"[html] Page weight {report['bytes_in']} -> {report['bytes_out']} bytes, "
+              f"{report['lazy_images']}/{report['images']} images lazy, "
+              f"{report['fonts_deduped']} font links deduped"
+              + (f", repaired {len(report['repaired'])} unclosed tags" if report["repaired"] else ""))
+    return page_html, report
+
+
+# Inputs whose change makes a running build stale, and the subset the images depend on
+# (the business name is in the hero prompt, but the images carry no text)
+BUILD_ESSENTIALS = ("business", "type", "vibe")
+IMAGE_ESSENTIALS = ("type", "vibe")
+
+_build_cancels = {}  # job_id -> cancel Event of the job's current generation
+_image_runs = {}     # job_id -> (image key, Future) of the latest image generation
+
+
+def _essentials(lead, fields=BUILD_ESSENTIALS):
+    return tuple((lead.get(k) or "").strip().lower() for k in fields)
+
+
+def changed_essentials(old_lead, new_lead):
+    """Design essentials the visitor changed (ignoring case/whitespace and fields not yet given)."""
+    old_lead = old_lead or {}
+    return [k for k in BUILD_ESSENTIALS
+            if (new_lead.get(k) or "").strip() and _essentials(old_lead, (k,)) != _essentials(new_lead, (k,))]
+
+
+def start_build(job_id, lead, generation=1):
+    """Start the background build for a job generation, cancelling the generation it supersedes."""
+    cancel = threading.Event()
+    with build_jobs.lock:
+        previous = _build_cancels.get(job_id)
+        if previous is not None:
+            previous.set()
+        _build_cancels[job_id] = cancel
+    thread = threading.Thread(target=build_page_in_background, args=(job_id, lead, generation, cancel))
+    thread.daemon = True
+    thread.start()
+
+
+def build_page_in_background(job_id, lead, generation=1, cancel=None):
+    try:
+        with job_trace.span(job_id, "build", generation=generation) as build_attrs:
+            build_attrs["result"] = _build_page(job_id, lead, generation, cancel)
+    finally:
+        with build_jobs.lock:
+            if _build_cancels.get(job_id) is cancel:
+                del _build_cancels[job_id]
+        _drop_image_run(job_id)
+
+
+def _drop_image_run(job_id):
+    """Forget a job's image future once it finished and no build of the job is left to reuse it."""
+    with build_jobs.lock:
+        run = _image_runs.get(job_id)
+        if run is not None and run[1] is not None and run[1].done() and job_id not in _build_cancels:
+            del _image_runs[job_id]
+
+
+def _images_for_build(job_id, lead, executor):
+    """Future with the build's images, shared with earlier generations whose image inputs match."""
+    key = _essentials(lead, IMAGE_ESSENTIALS)
+    with build_jobs.lock:
+        job = build_jobs.get(job_id, reload=False) or {}
+        if job.get("images") and job.get("images_key") == key:
+            job_trace.event(job_id, "images.reused", source="previous_build")
+            future = Future()
+            future.set_result(job["images"])
+            return future
+        run = _image_runs.get(job_id)
+        if run is not None and run[0] == key:
+            job_trace.event(job_id, "images.reused", source="in_flight")
+            return run[1]
+
+        def superseded():
+            current = _image_runs.get(job_id)
+            return current is not None and current[0] != key
+
+        _image_runs[job_id] = (key, None)  # registered before the worker can check it
+        future = executor.submit(generate_images_for_page, lead, job_id, superseded)
+        _image_runs[job_id] = (key, future)
+    # Covers image runs that outlive their builds (result timed out, job reaped)
+    future.add_done_callback(lambda _: _drop_image_run(job_id))
+    return future
+
+
+def _publish(job_id, generation, **fields):
+    """Apply a build result only if its generation is still the job's latest."""
+    with build_jobs.lock:
+        job = build_jobs.get(job_id, reload=False)
+        if job is None or job.get("generation", 1) != generation:
+            return False
+        build_jobs.update(job_id, **fields)
+        return True
+
+
+def _publish_failure(job_id, generation, lead, result):
+    """Record a failed build. A page an earlier generation already built stays published."""
+    with build_jobs.lock:
+        job = build_jobs.get(job_id, reload=False)
+        if job is None or job.get("generation", 1) != generation:
+            return
+        kept = job.get("revision", 0) >= 1
+        build_jobs.update(job_id, status="done" if kept else "error")
+    if kept:
+        job_trace.event(job_id, "build.failed", generation=generation, result=result, kept_revision=job["revision"])
+        save_lead_to_db(job_id, lead, status="done", generation=generation)
+    else:
+        save_lead_to_db(job_id, lead, status="error", generation=generation)
+
+
+def _build_page(job_id, lead, generation=1, cancel=None):
     try:
         with ThreadPoolExecutor(max_workers=2) as executor:
-            page_future = executor.submit(_generate_page_html, lead)
-            image_future = executor.submit(generate_images_for_page, lead)
+            page_future = executor.submit(_generate_page_html, lead, job_id, cancel)
+            image_future = _images_for_build(job_id, lead, executor)
 
-            page_html = page_future.result(timeout=80)
+            raw_html = page_future.result(timeout=80)
             try:
                 images = image_future.result(timeout=80)
             except Exception as img_err:
                 print(f"[build] Image generation failed, continuing without: {img_err}")
                 images = {}
+        if cancel is not None and cancel.is_set():
+            raise BuildCancelled("superseded before publish")
 
-        page_html = _inject_images_into_page(page_html, images)
+        page_html, report = finalize_page_html(raw_html, images, job_id)
 
         if page_html:
-            with build_lock:
-                build_jobs[job_id]["status"] = "done"
-                build_jobs[job_id]["page"] = page_html
-            save_lead_to_db(job_id, lead, status="done", page_html=page_html)
-        else:
-            print(f"[build] Invalid HTML generated for job {job_id}")
-            with build_lock:
-                build_jobs[job_id]["status"] = "error"
-                build_jobs[job_id]["page"] = None
-            save_lead_to_db(job_id, lead, status="error")
-
+            if not _publish(job_id, generation, status="done", page=page_html, revision=generation,
+                            page_bytes=report["bytes_out"], images=images,
+                            images_key=_essentials(lead, IMAGE_ESSENTIALS)):
+                raise BuildCancelled("superseded before publish")
+            job_trace.event(job_id, "build.done", page_bytes=report["bytes_out"], images=len(images), generation=generation)
+            save_lead_to_db(job_id, lead, status="done", page_html=page_html, generation=generation)
+            return "done"
+        # The instant template preview (revision 0) or the previous build, if any, stays up
+        print(f"[build] Invalid HTML generated for job {job_id}")
+        _publish_failure(job_id, generation, lead, "invalid_html")
+        return "invalid_html"
+
+    except BuildCancelled as e:
+        print(f"[build] Generation {generation} of job {job_id} {e}")
+        return "superseded"
     except Exception as e:
         print(f"[build] Error building page for job {job_id}: {e}")
-        with build_lock:
-            build_jobs[job_id]["status"] = "error"
-            build_jobs[job_id]["page"] = None
-        save_lead_to_db(job_id, lead, status="error")
+        _publish_failure(job_id, generation, lead, "error")
+        return "error"
+
+
+def render_instant_preview(lead, job_id=None):
+    """Revision 0 of a job: a template page from index.html's themes, ready in under a millisecond."""
+    try:
+        with job_trace.span(job_id, "preview.template"):
+            templates = load_templates(os.path.join(app.root_path, "index.html"))
+            return render_template_preview(lead, templates)
+    except Exception as e:
+        print(f"[preview] Template preview failed: {e}")
+        return None
 
 
 def build_context_block(context):
@@ -495,7 +948,7 @@ def call_chat_model(api_messages, lead_context, visitor_context=None):
 
     full_messages = [{"role": "system", "content": system_prompt}, *api_messages]
 
-    response = xai_client.chat.completions.create(
+    response = get_xai_client().chat.completions.create(
         model=CHAT_MODEL,
         messages=full_messages,
         max_tokens=1024,
@@ -534,9 +987,130 @@ def call_chat_model(api_messages, lead_context, visitor_context=None):
     return result, lead
 
 
+_index_cache = {}
+_index_lock = threading.Lock()
+
+warm_state = {"modules": False, "assets": False, "db": False}
+DB_READY_RETRY_SECONDS = 5
+_db_warm_attempted_at = 0.0
+_db_warm_lock = threading.Lock()
+
+
+def _load_index_variants():
+    """index.html as raw and gzip bytes, rebuilt only when the file changes."""
+    path = os.path.join(app.root_path, "index.html")
+    mtime = os.stat(path).st_mtime
+    cached = _index_cache.get("variants")
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with _index_lock:
+        cached = _index_cache.get("variants")
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, "rb") as f:
+            raw = f.read()
+        variants = {"identity": raw, "gzip": gzip.compress(raw, compresslevel=9)}
+        _index_cache["variants"] = (mtime, variants)
+        return variants
+
+
+def warmup():
+    """Pre-fork warmup: only state that is safe to share across forked workers."""
+    start = time.perf_counter()
+    try:
+        import openai  # noqa: F401
+        import pg8000  # noqa: F401
+        try:
+            import gspread  # noqa: F401
+            import google.oauth2.service_account  # noqa: F401
+        except ImportError as e:
+            print(f"[sheets] gspread not available: {e}")
+        warm_state["modules"] = True
+    except Exception as e:
+        print(f"[warmup] Module import failed: {e}")
+    try:
+        _load_index_variants()
+        load_templates(os.path.join(app.root_path, "index.html"))
+        CHAT_SYSTEM_PROMPT.format(context_block="", lead_summary="")
+        warm_state["assets"] = True
+    except Exception as e:
+        print(f"[warmup] Asset warmup failed: {e}")
+    print(f"[warmup] Pre-fork warmup done in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+
+def warm_worker():
+    """Post-fork warmup: per-process clients and a primed DB pool."""
+    reset_db_pool()
+    if not DATABASE_URL:
+        return
+    _warm_db()
+
+
+def _retry_db_warmup():
+    global _db_warm_attempted_at
+    if not _db_warm_lock.acquire(blocking=False):
+        return  # an attempt is already running
+    if time.monotonic() - _db_warm_attempted_at < DB_READY_RETRY_SECONDS:
+        _db_warm_lock.release()
+        return
+
+    def attempt():
+        try:
+            _warm_db()
+        finally:
+            _db_warm_lock.release()
+
+    _db_warm_attempted_at = time.monotonic()
+    threading.Thread(target=attempt, daemon=True).start()
+
+
+def _warm_db():
+    global _db_warm_attempted_at
+    _db_warm_attempted_at = time.monotonic()
+    try:
+        with db_connection() as conn:
+            lead_analytics.ensure_leads_schema(conn)
+            try:
+                lead_analytics.ensure_schema(conn)
+            except Exception as e:
+                print(f"[warmup] Analytics schema setup failed: {e}")
+        warm_state["db"] = True
+    except Exception as e:
+        print(f"[warmup] DB warmup failed: {e}")
+
+
+@app.before_request
+def hide_trace_sink():
+    # The app root is the static folder; never serve the trace sink even if JOB_TRACE_PATH points into it
+    if request.path.endswith((".jsonl", ".jsonl.1")):
+        path = os.path.realpath(os.path.join(app.root_path, request.path.lstrip("/")))
+        if path in (os.path.realpath(job_trace.TRACE_PATH), os.path.realpath(job_trace.TRACE_PATH + ".1")):
+            return jsonify({"error": "Not found"}), 404
+
+
 @app.route("/")
 def index():
-    return send_from_directory(".", "index.html")
+    try:
+        variants = _load_index_variants()
+    except OSError:
+        return send_from_directory(".", "index.html")
+    if "gzip" in request.headers.get("Accept-Encoding", ""):
+        resp = Response(variants["gzip"], mimetype="text/html")
+        resp.headers["Content-Encoding"] = "gzip"
+    else:
+        resp = Response(variants["identity"], mimetype="text/html")
+    resp.headers["Vary"] = "Accept-Encoding"
+    return resp
+
+
+@app.route("/api/ready", methods=["GET"])
+def api_ready():
+    if DATABASE_URL and not warm_state["db"]:
+        # The DB may have been unreachable when this worker started; retry off the request
+        # thread (a connect to an unreachable host blocks for the OS TCP timeout)
+        _retry_db_warmup()
+    ready = warm_state["modules"] and warm_state["assets"] and (warm_state["db"] or not DATABASE_URL)
+    return jsonify({"ready": ready, "warm": warm_state}), 200 if ready else 503
 
 
 @app.route("/api/design", methods=["POST"])
@@ -547,7 +1121,7 @@ def api_design():
         return jsonify({"error": "Please describe a style."}), 400
 
     try:
-        response = xai_client.chat.completions.create(
+        response = get_xai_client().chat.completions.create(
             model=DESIGN_MODEL,
             messages=[
                 {"role": "system", "content": STYLE_SCHEMA_DESCRIPTION},
@@ -620,7 +1194,7 @@ def api_chat():
         context_block = build_context_block(visitor_context)
         system_prompt = CHAT_SYSTEM_PROMPT.format(context_block=context_block, lead_summary="")
         try:
-            response = xai_client.chat.completions.create(
+            response = get_xai_client().chat.completions.create(
                 model=CHAT_MODEL,
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -658,42 +1232,66 @@ def api_chat():
     # Phase 1: Design essentials collected (business + type + vibe) — start building
     if has_design_essentials and not existing_job:
         job_id = str(uuid.uuid4())
-        with build_lock:
-            build_jobs[job_id] = {
-                "status": "building",
-                "page": None,
-                "lead": lead.copy(),
-                "email_collected": has_email
-            }
+        job_trace.event(job_id, "build.triggered", entry_point=(visitor_context or {}).get("entryPoint", ""),
+                        type=lead.get("type", ""), vibe=lead.get("vibe", ""), email_collected=has_email)
+        instant_page = render_instant_preview(lead, job_id)
+        build_jobs.create(job_id, {
+            "status": "building",
+            "page": instant_page,
+            "revision": 0,
+            "generation": 1,
+            "lead": lead.copy(),
+            "email_collected": has_email
+        })
         save_lead_to_db(job_id, lead, status="building", entry_context=entry_ctx_str)
 
         # Start background build
-        thread = threading.Thread(target=build_page_in_background, args=(job_id, lead))
-        thread.daemon = True
-        thread.start()
+        start_build(job_id, lead, generation=1)
 
         return jsonify({
             "reply": result.get("reply", "Understood. Continue."),
             "lead": lead,
             "buildTriggered": True,
             "jobId": job_id,
-            "showPreview": False  # NEW: Don't show preview yet
+            "showPreview": bool(has_email and instant_page),
+            "page": instant_page if has_email else None,
+            "revision": 0,
+            "generation": 1
         })
 
     # Phase 2: Build already started, continue conversation
-    elif existing_job and existing_job in build_jobs:
+    elif existing_job and build_jobs.get(existing_job) is not None:
         # Update lead data in job
-        with build_lock:
-            build_jobs[existing_job]["lead"] = lead.copy()
-            build_jobs[existing_job]["email_collected"] = has_email
-            build_status = build_jobs[existing_job]["status"]
-            has_page = build_jobs[existing_job]["page"] is not None
+        fields = {"lead": lead.copy(), "email_collected": has_email}
+        superseding = None
+        with build_jobs.lock:
+            current = build_jobs.get(existing_job, reload=False) or {}
+            changed = changed_essentials(current.get("lead"), lead) if current else []
+            if changed:
+                # Business/type/vibe changed: the running build is stale, a new generation replaces it
+                superseding = current.get("generation", 1) + 1
+                fields.update(status="building", generation=superseding)
+                job_trace.event(existing_job, "build.superseded", changed=changed,
+                                previous_generation=superseding - 1, generation=superseding,
+                                previous_status=current.get("status"))
+            if fields.get("status", current.get("status")) == "building" and current.get("revision") == 0:
+                # Keep the instant preview in step with the details gathered so far
+                fields["page"] = render_instant_preview(lead) or current.get("page")
+            job = build_jobs.update(existing_job, **fields)
+        if job is None:
+            job = build_jobs.get(existing_job) or {"status": "building", "page": None}
+        elif superseding:
+            print(f"[build] Superseding job {existing_job} with generation {superseding} ({', '.join(changed)} changed)")
+            start_build(existing_job, lead, generation=superseding)
+        build_status = job["status"]
+        has_page = job["page"] is not None
 
         # Update database with enriched lead data
-        save_lead_to_db(existing_job, lead, status=build_status, entry_context=entry_ctx_str)
+        save_lead_to_db(existing_job, lead, status=build_status, entry_context=entry_ctx_str,
+                        generation=job.get("generation"))
 
-        # Check if BOTH conditions met for preview
-        show_preview = has_email and build_status == "done" and has_page
+        # Email collected and some revision (instant template or final build) is available
+        show_preview = has_email and has_page
 
         return jsonify({
             "reply": result.get("reply", "Got it."),
@@ -701,7 +1299,9 @@ def api_chat():
             "buildTriggered": True,
             "jobId": existing_job,
             "showPreview": show_preview,  # NEW: Signal when ready
-            "page": build_jobs[existing_job]["page"] if show_preview else None
+            "page": job["page"] if show_preview else None,
+            "revision": job.get("revision", 1),
+            "generation": job.get("generation", 1)
         })
 
     # Phase 0: Still collecting minimum data
@@ -715,29 +1315,45 @@ def api_chat():
 
 @app.route("/api/chat/status/<job_id>", methods=["GET"])
 def chat_status(job_id):
-    with build_lock:
-        job = build_jobs.get(job_id)
-        if not job:
-            return jsonify({"status": "not_found"}), 404
-        status = job["status"]
-        page = job.get("page")
-        email_collected = job.get("email_collected", False)
+    job = build_jobs.get(job_id)
+    if not job:
+        return jsonify({"status": "not_found"}), 404
+    status = job["status"]
+    page = job.get("page")
+    email_collected = job.get("email_collected", False)
+    if status == "done" and not job.get("done_polled"):
+        build_jobs.update(job_id, done_polled=True)
+        job_trace.event(job_id, "poll.first_done", email_collected=email_collected)
 
     if status == "building":
         return jsonify({
             "status": "building",
+            "page": page,
+            "revision": job.get("revision", 0),
+            "generation": job.get("generation", 1),
             "emailCollected": email_collected
         })
     elif status == "done":
         return jsonify({
             "status": "done",
             "page": page,
+            "revision": job.get("revision", 1),
+            "generation": job.get("generation", 1),
+            "pageBytes": job.get("page_bytes", len(page or "")),
             "emailCollected": email_collected
         })
     else:
         return jsonify({"status": "error"})
 
 
+@app.route("/api/jobs/<job_id>/timeline", methods=["GET"])
+def job_timeline(job_id):
+    data = job_trace.timeline(job_id)
+    if data is None:
+        return jsonify({"error": "No trace for this job"}), 404
+    return jsonify(data)
+
+
 @app.route("/api/chat/continue", methods=["POST"])
 def chat_continue():
     data = request.get_json(silent=True) or {}
@@ -773,12 +1389,12 @@ def chat_continue():
 @app.route("/api/leads", methods=["GET"])
 def api_leads():
     try:
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute("SELECT id, job_id, business, type, vibe, email, name, phone, tagline, colors, services, audience, features, status, entry_context, created_at FROM leads ORDER BY created_at DESC LIMIT 100")
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
+        with db_connection() as conn:
+            lead_analytics.ensure_leads_schema(conn)
+            cur = conn.cursor()
+            cur.execute("SELECT id, job_id, business, type, vibe, email, name, phone, tagline, colors, services, audience, features, status, entry_context, created_at, entry_point FROM leads ORDER BY created_at DESC LIMIT 100")
+            rows = cur.fetchall()
+            cur.close()
         leads = []
         for row in rows:
             leads.append({
@@ -798,6 +1414,7 @@ def api_leads():
                 "status": row[13],
                 "entry_context": row[14],
                 "created_at": row[15].isoformat() if row[15] else None,
+                "entry_point": row[16] or "",
             })
         return jsonify(leads)
     except Exception as e:
@@ -805,6 +1422,24 @@ def api_leads():
         return jsonify({"error": "Failed to fetch leads"}), 500
 
 
+@app.route("/api/analytics", methods=["GET"])
+def api_analytics():
+    try:
+        days = max(1, min(int(request.args.get("days", 30)), 366))
+    except ValueError:
+        return jsonify({"error": "days must be a number"}), 400
+    group_by = tuple(g for g in request.args.get("by", "entry_point").split(",") if g)
+    if not group_by or any(g not in lead_analytics.GROUP_FIELDS for g in group_by):
+        return jsonify({"error": f"by must be a comma-separated subset of {', '.join(lead_analytics.GROUP_FIELDS)}"}), 400
+    try:
+        with db_connection() as conn:
+            rows = lead_analytics.funnel_report(conn, days=days, group_by=group_by)
+        return jsonify({"days": days, "by": list(group_by), "rows": rows})
+    except Exception as e:
+        print(f"[analytics] Error: {e}")
+        return jsonify({"error": "Failed to load analytics"}), 500
+
+
 @app.route("/api/faq", methods=["POST"])
 def api_faq():
     data = request.get_json(silent=True) or {}
@@ -833,7 +1468,7 @@ Rules:
 - Keep answers brief and actionable"""
 
     try:
-        response = xai_client.chat.completions.create(
+        response = get_xai_client().chat.completions.create(
             model=CHAT_MODEL,
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -850,4 +1485,6 @@ Rules:
 
 
 if __name__ == "__main__":
+    warmup()
+    warm_worker()
     app.run(host="0.0.0.0", port=5000, debug=False)